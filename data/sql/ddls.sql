@@ -56,6 +56,9 @@ CREATE TABLE `cnpj_estabelecimentos` (
   `situacao_especial` varchar(100) DEFAULT NULL,
   `data_situacao_especial` varchar(8) DEFAULT NULL,
   KEY `cnpj_estabelecimentos_cnpj_part1_IDX` (`cnpj_part1`) USING BTREE,
+  KEY `idx_estabelecimentos_cnpj_keyset` (`cnpj_part1`,`cnpj_part2`,`cnpj_part3`),
+  KEY `idx_estabelecimentos_uf_situacao_keyset` (`uf`,`situacao_cadastral`,`cnpj_part1`,`cnpj_part2`,`cnpj_part3`),
+  KEY `idx_estabelecimentos_municipio_situacao_keyset` (`codigo_municipio`,`situacao_cadastral`,`cnpj_part1`,`cnpj_part2`,`cnpj_part3`),
   KEY `cnpj_estabelecimentos_data_inicio_atividade_IDX` (`data_inicio_atividade`) USING BTREE,
   KEY `cnpj_estabelecimentos_cnae_IDX` (`cnae`) USING BTREE,
   KEY `cnpj_estabelecimentos_uf_IDX` (`uf`) USING BTREE,
@@ -0,0 +1,41 @@
+-- cnpj.cnpj_estabelecimentos índices de paginação por keyset
+-- Idempotente: cada índice só é criado se ainda não existir (bancos criados com DDL antigo)
+
+-- Chave completa do CNPJ (ORDER BY da paginação sem filtros)
+SET @sql := IF(
+  (SELECT COUNT(*) FROM information_schema.statistics
+    WHERE table_schema = DATABASE()
+      AND table_name = 'cnpj_estabelecimentos'
+      AND index_name = 'idx_estabelecimentos_cnpj_keyset') = 0,
+  'CREATE INDEX idx_estabelecimentos_cnpj_keyset ON cnpj_estabelecimentos (cnpj_part1, cnpj_part2, cnpj_part3)',
+  'SELECT 1'
+);
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- UF + situação cadastral, já na ordem do keyset
+SET @sql := IF(
+  (SELECT COUNT(*) FROM information_schema.statistics
+    WHERE table_schema = DATABASE()
+      AND table_name = 'cnpj_estabelecimentos'
+      AND index_name = 'idx_estabelecimentos_uf_situacao_keyset') = 0,
+  'CREATE INDEX idx_estabelecimentos_uf_situacao_keyset ON cnpj_estabelecimentos (uf, situacao_cadastral, cnpj_part1, cnpj_part2, cnpj_part3)',
+  'SELECT 1'
+);
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- Município + situação cadastral, já na ordem do keyset
+SET @sql := IF(
+  (SELECT COUNT(*) FROM information_schema.statistics
+    WHERE table_schema = DATABASE()
+      AND table_name = 'cnpj_estabelecimentos'
+      AND index_name = 'idx_estabelecimentos_municipio_situacao_keyset') = 0,
+  'CREATE INDEX idx_estabelecimentos_municipio_situacao_keyset ON cnpj_estabelecimentos (codigo_municipio, situacao_cadastral, cnpj_part1, cnpj_part2, cnpj_part3)',
+  'SELECT 1'
+);
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
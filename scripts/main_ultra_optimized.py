@@ -42,17 +42,21 @@ def generate_output_filename(base_path: str, filters: dict = None,
     """
     path_obj = Path(base_path)
     
+    # Extensão composta (.csv.gz) é preservada inteira no final do nome
+    suffix = ''.join(path_obj.suffixes[-2:]) if path_obj.suffix == '.gz' else path_obj.suffix
+    stem = path_obj.name[:-len(suffix)] if suffix else path_obj.name
+    
     # Verificar se há filtro de UF
     if filters and 'uf' in filters:
         uf = filters['uf'].upper()
         # Adicionar sufixo _UF ao nome do arquivo
-        base_name = f"{path_obj.stem}_{uf}"
+        base_name = f"{stem}_{uf}"
     else:
         # Se não há filtro de UF ou são todas as UFs, usar sufixo _BR
-        base_name = f"{path_obj.stem}_BR"
+        base_name = f"{stem}_BR"
     
     # Adicionar numeração de partes
-    new_name = f"{base_name}_{file_part}_de_{total_parts}{path_obj.suffix}"
+    new_name = f"{base_name}_{file_part}_de_{total_parts}{suffix}"
     return str(path_obj.parent / new_name)
 
 
@@ -88,7 +92,7 @@ Exemplos de uso:
     parser.add_argument(
         '--output',
         type=str,
-        help='Caminho do arquivo de saída (padrão: output/cnpj_empresas.csv)'
+        help='Caminho do arquivo de saída (padrão: output/cnpj_empresas.csv; use .parquet para Parquet ou .csv.gz para CSV compactado)'
     )
 
     parser.add_argument(
@@ -142,6 +146,8 @@ Exemplos de uso:
     # Configurar tamanho do lote personalizado
     if args.batch_size != 50000:
         processor.batch_size = args.batch_size
+        # O ajuste dinâmico pode crescer até o tamanho pedido explicitamente
+        processor.max_batch_size = max(processor.max_batch_size, args.batch_size)
         logger.info("Tamanho do lote configurado para: %s registros", f"{args.batch_size:,}")
 
     try:
@@ -162,16 +168,15 @@ Exemplos de uso:
             logger.info("Total de registros encontrados: %s", f"{total:,}")
             return 0
 
-        # Obter contagem total de registros (sem limite para divisão de arquivos)
+        # Obter contagem total de registros (sem limite global, para divisão de arquivos);
+        # com --limit a contagem para no limite em vez de percorrer toda a tabela
         logger.info("📊 Contando registros...")
         processor.connect_database()
-        total_records = processor.get_total_count_optimized(filters, apply_limit=False)
+        total_records = processor.get_total_count_optimized(
+            filters, apply_limit=False, max_count=max(args.limit, 0)
+        )
         processor.close_database()
         
-        # Aplicar limite se especificado
-        if args.limit > 0:
-            total_records = min(total_records, args.limit)
-        
         logger.info("Total de registros a processar: %s", f"{total_records:,}")
         
         # Determinar se precisa dividir arquivos
@@ -190,36 +195,39 @@ Exemplos de uso:
 
         # Executar processamento com divisão de arquivos
         processor.connect_database()
-        processor.setup_ultra_optimization_settings()
-        processor.preload_lookup_caches()
+        try:
+            processor.setup_ultra_optimization_settings()
+            processor.preload_lookup_caches()
         
-        processed_total = 0
-        for file_part in range(1, total_files + 1):
-            # Calcular limites para este arquivo
-            start_offset = (file_part - 1) * max_records_per_file
-            file_limit = min(max_records_per_file, total_records - start_offset)
+            processed_total = 0
+            for file_part in range(1, total_files + 1):
+                # Calcular limites para este arquivo
+                start_offset = (file_part - 1) * max_records_per_file
+                file_limit = min(max_records_per_file, total_records - start_offset)
             
-            # Gerar nome do arquivo para esta parte
-            output_file = generate_output_filename(base_output, filters, file_part, total_files)
+                # Gerar nome do arquivo para esta parte
+                output_file = generate_output_filename(base_output, filters, file_part, total_files)
             
-            logger.info("🚀 Processando arquivo %s de %s: %s", 
-                       file_part, total_files, Path(output_file).name)
-            logger.info("📊 Registros neste arquivo: %s (offset: %s)", 
-                       f"{file_limit:,}", f"{start_offset:,}")
+                logger.info("🚀 Processando arquivo %s de %s: %s", 
+                           file_part, total_files, Path(output_file).name)
+                logger.info("📊 Registros neste arquivo: %s (offset: %s)", 
+                           f"{file_limit:,}", f"{start_offset:,}")
             
-            # Executar processamento para este arquivo
-            processor.run_ultra_optimized_with_offset(
-                limit=file_limit,
-                offset=start_offset,
-                output_path=output_file,
-                filters_dict=filters
-            )
+                # Executar processamento para este arquivo
+                processor.run_ultra_optimized_with_offset(
+                    limit=file_limit,
+                    offset=start_offset,
+                    output_path=output_file,
+                    filters_dict=filters
+                )
             
-            processed_total += file_limit
-            logger.info("✅ Arquivo %s de %s concluído! (%s/%s registros processados)", 
-                       file_part, total_files, f"{processed_total:,}", f"{total_records:,}")
+                processed_total += file_limit
+                logger.info("✅ Arquivo %s de %s concluído! (%s/%s registros processados)", 
+                           file_part, total_files, f"{processed_total:,}", f"{total_records:,}")
+        finally:
+            # Fecha writers, executores e conexão também quando uma parte falha
+            processor.close_database()
         
-        processor.close_database()
         logger.info("✅ Processamento ULTRA concluído com sucesso! %s arquivos gerados", total_files)
         return 0
 
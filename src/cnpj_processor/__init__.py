@@ -2,6 +2,17 @@
 Módulo de processamento de dados CNPJ
 """
 
-from .cnpj_processor import CNPJProcessor
+from .cnpj_processor_ultra_optimized import CNPJProcessorUltraOptimized
 
-__all__ = ['CNPJProcessor']
+__all__ = ['CNPJProcessorUltraOptimized']
+
+# Processador padrão (cnpj_processor.py) não acompanha todas as instalações:
+# sem ele o pacote continua importável para o processador ULTRA, e quem
+# precisar de CNPJProcessor recebe ImportError na importação
+try:
+    from .cnpj_processor import CNPJProcessor
+except ModuleNotFoundError as e:
+    if e.name != f"{__name__}.cnpj_processor":
+        raise
+else:
+    __all__.append('CNPJProcessor')
@@ -4,18 +4,48 @@ CNPJ Processor ULTRA Otimizado - Versão para Máxima Performance
 Versão com consultas mínimas, cache agressivo e processamento em streaming
 """
 
-import csv
+import ctypes
+import gzip
+import io
+import json
 import logging
 import os
 import re
+import socket
 import sys
 import time
+from urllib.parse import quote
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 
+import numpy as np
 import pandas as pd
-import pymysql
-from sqlalchemy import create_engine
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from pymysql.converters import escape_item
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Engine
+
+# Driver MySQL: mysqlclient (extensão C) quando instalado, senão pymysql (Python puro)
+try:
+    import MySQLdb  # noqa: F401
+    MYSQL_DRIVER = "mysqldb"
+except ImportError:
+    MYSQL_DRIVER = "pymysql"
+
+# connectorx (opcional): leitura dos lotes direto para Arrow/pandas em Rust
+try:
+    import connectorx as cx
+except ImportError:
+    cx = None
+
+# glibc (Linux): malloc_trim devolve ao sistema a memória liberada entre lotes
+try:
+    LIBC = ctypes.CDLL("libc.so.6") if sys.platform.startswith("linux") else None
+except OSError:
+    LIBC = None
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 
@@ -26,6 +56,192 @@ from src.config.config import OUTPUT_CONFIG
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Query base ultra otimizada - apenas JOINs essenciais (filtros, cursor e LIMIT são anexados)
+BASE_QUERY_ULTRA = """
+SELECT 
+    CONCAT(
+        LPAD(est.cnpj_part1, 8, '0'), 
+        LPAD(est.cnpj_part2, 4, '0'), 
+        LPAD(est.cnpj_part3, 2, '0')
+    ) as cnpj,
+    est.identificador_matriz_filial,
+    e.razao_social,
+    est.nome_fantasia,
+    est.situacao_cadastral,
+    est.data_situacao_cadastral,
+    est.motivo_situacao_cadastral,
+    est.cidade_estrangeira,
+    CASE WHEN est.codigo_pais = 0 THEN 105 ELSE est.codigo_pais END AS codigo_pais,
+    est.data_inicio_atividade,
+    est.cnae,
+    est.tipo_logradouro,
+    est.logradouro,
+    est.numero,
+    est.complemento,
+    est.bairro,
+    est.cep,
+    est.uf,
+    est.codigo_municipio,
+    est.ddd1,
+    est.telefone1,
+    est.ddd2,
+    est.telefone2,
+    CONCAT(est.ddd_fax, est.fax) AS ddd_fax,
+    est.correio_eletronico,
+    e.qualificacao_socio,
+    e.capital_social,
+    e.porte_empresa,
+    s.opcao_simples,
+    s.data_opcao_simples,
+    s.data_exclusao_simples,
+    s.opcao_mei,
+    est.situacao_especial,
+    est.data_situacao_especial,
+    est.cnaes_secundarios,
+    s.data_opcao_mei,
+    s.data_exclusao_opcao_mei
+FROM cnpj_estabelecimentos est
+INNER JOIN cnpj_empresas e ON est.cnpj_part1 = e.cnpj_part1
+LEFT JOIN cnpj_simples s ON e.cnpj_part1 = s.cnpj_part1
+WHERE est.cnpj_part1 IS NOT NULL
+"""
+
+# Tipos inteiros compactos para códigos de baixa amplitude
+INTEGER_DOWNCAST_DTYPES = {
+    'situacao_cadastral': 'int8',
+    'identificador_matriz_filial': 'int8',
+    'codigo_pais': 'int16',
+    'codigo_municipio': 'int32'
+}
+
+# Rótulos da situação cadastral na saída
+SITUACAO_CADASTRAL_LABELS = {
+    2: 'ATIVA',
+    4: 'INAPTA',
+    8: 'SUSPENSA'
+}
+
+# Formato de email aceito na saída
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+# Renomeação das colunas da query para os nomes de saída
+COLUMNS_MAPPING_ULTRA = {
+    'identificador_matriz_filial': 'identificador_m_f',
+    'motivo_situacao_cadastral': 'motivo_situacao_cadastral',
+    'cidade_estrangeira': 'nome_cidade_exterior',
+    'natureza_juridica': 'codigo_natureza_juridica',
+    'cnae': 'cnae_codes',
+    'ddd1': 'ddd_telefone_1',
+    'telefone1': 'telefone1_celular',
+    'ddd2': 'ddd_telefone_2',
+    'telefone2': 'telefone2_celular',
+    'correio_eletronico': 'email',
+    'qualificacao_socio': 'qualificacao_responsavel',
+    'capital_social': 'capital_social_empresa',
+    'porte_empresa': 'porte_empresa'
+}
+
+# Engines SQLAlchemy compartilhadas por DSN: o pool de conexões é reaproveitado
+# entre execuções (ex.: vários arquivos no mesmo processo)
+_ENGINES: Dict[URL, Engine] = {}
+
+# Consultas de sócios (listas IN) executadas em paralelo; cabe no pool da engine
+SOCIOS_PARALLEL_WORKERS = 4
+
+# Erros do MySQL em que dividir a lista IN ao meio pode resolver; os demais
+# (ex.: conexão perdida, 2006/2013) são relançados sem novas tentativas
+SOCIOS_SPLIT_RETRY_ERRORS = {
+    1038,  # ER_OUT_OF_SORTMEMORY
+    1041,  # ER_OUT_OF_RESOURCES
+    1153,  # ER_NET_PACKET_TOO_LARGE (max_allowed_packet)
+    3024,  # ER_QUERY_TIMEOUT (max_execution_time)
+}
+
+# Buffers de socket para leitura em massa (padrão do kernel é dimensionado para OLTP)
+SOCKET_BUFFER_SIZE = 1 << 20
+
+
+def tune_socket_buffers(dbapi_connection, connection_record):
+    """Amplia SO_RCVBUF/SO_SNDBUF da conexão (pymysql expõe o socket; mysqlclient não)"""
+    sock = getattr(dbapi_connection, '_sock', None)
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    except OSError as e:
+        logger.debug("Não foi possível ajustar buffers do socket: %s", e)
+
+
+# Buffers por sessão moderados: acima de ~2MB a alocação (mmap) custa mais do
+# que ganha, e o keyset por índice não precisa de sort grande
+SESSION_SETTINGS = [
+    "sort_buffer_size = 2*1024*1024",  # 2MB
+    "join_buffer_size = 2*1024*1024",  # 2MB
+    "read_buffer_size = 1024*1024",  # 1MB
+    
+    # Otimizações de consulta
+    "tmp_table_size = 256*1024*1024",  # 256MB
+    "max_heap_table_size = 256*1024*1024",  # 256MB
+    
+    # Configurações de thread (removido thread_cache_size - é variável global)
+]
+
+SESSION_OPTIMIZATION_QUERIES = [
+    # Otimizações de índice
+    "SET SESSION optimizer_switch = 'index_merge=on,index_merge_union=on,index_merge_sort_union=on'",
+]
+
+
+def apply_session_settings(dbapi_connection, connection_record):
+    """Aplica as variáveis de sessão ULTRA em cada conexão nova do pool"""
+    cursor = dbapi_connection.cursor()
+    try:
+        # Um único SET para todas as variáveis numéricas (uma ida ao servidor)
+        try:
+            cursor.execute("SET SESSION " + ", ".join(SESSION_SETTINGS))
+        except Exception as e:
+            # O MySQL descarta o SET inteiro se uma variável for rejeitada (versão ou
+            # privilégio): aplicar uma a uma para manter as demais
+            logger.debug("SET combinado rejeitado (%s), aplicando variáveis individualmente", e)
+            for setting in SESSION_SETTINGS:
+                try:
+                    cursor.execute("SET SESSION " + setting)
+                except Exception as setting_error:
+                    logger.warning("Erro ao aplicar otimização: %s - %s", setting, setting_error)
+        
+        for query in SESSION_OPTIMIZATION_QUERIES:
+            try:
+                cursor.execute(query)
+            except Exception as e:
+                logger.warning("Erro ao aplicar otimização: %s - %s", query, e)
+    finally:
+        cursor.close()
+
+
+def get_engine(connection_url: URL) -> Engine:
+    """Retorna a engine (com pool) associada ao DSN, criando-a se necessário"""
+    engine = _ENGINES.get(connection_url)
+    if engine is None:
+        engine = create_engine(
+            connection_url,
+            pool_size=5,
+            max_overflow=5,
+            pool_pre_ping=True,  # Descarta conexões derrubadas pelo wait_timeout
+            pool_recycle=3600,
+            connect_args={
+                'autocommit': True,
+                'connect_timeout': 60,
+                'read_timeout': 300,
+                'write_timeout': 300
+            },
+            echo=False
+        )
+        event.listen(engine, 'connect', tune_socket_buffers)
+        event.listen(engine, 'connect', apply_session_settings)
+        _ENGINES[connection_url] = engine
+    return engine
+
 
 class CNPJProcessorUltraOptimized:
     """
@@ -39,57 +255,79 @@ class CNPJProcessorUltraOptimized:
     def __init__(self):
         self.connection = None
         self.engine = None
+        self.connectorx_url = None
         self.batch_size = 10000  # Lotes pequenos para performance consistente
-        self.cache_size = 10000  # Cache maior
-        self.max_batch_size = 15000  # Tamanho máximo do lote
+        self.max_batch_size = 50000  # Tamanho máximo do lote (páginas keyset maiores = menos idas ao banco)
         self.min_batch_size = 5000   # Tamanho mínimo do lote
+        self.last_throughput = 0.0   # Registros/s do lote anterior (controle do tamanho do lote)
+        self.target_batch_time = 10.0  # Duração alvo de um lote (segundos)
+        self.batch_time_ema = 0.0    # Média móvel exponencial da duração dos lotes
         
-        # Caches para lookup tables (sem cache de sócios - tabela muito grande)
+        # Caches para lookup tables (sem cache de sócios: no keyset cada CNPJ é visitado uma vez)
         self.cnae_cache = {}
         self.municipio_cache = {}
         self.pais_cache = {}
+        self.qualificacao_cache = {}
+        
+        # Índices existentes em cnpj_estabelecimentos (hints só para índices presentes)
+        self.available_indexes = set()
+        
+        # Ordem final das colunas, calculada no primeiro lote e reaproveitada nos seguintes
+        self.input_columns: tuple = None
+        self.output_columns: list = None
+        
+        # Writer Parquet mantido aberto entre lotes (saída .parquet)
+        self.parquet_writer = None
+        # Arquivo CSV mantido aberto entre lotes (um único handle por arquivo de saída)
+        self.csv_sink = None
+        self.csv_sink_path: str = None
+        
+        # Sem filtros os lotes cobrem intervalos contíguos de cnpj_part1: sócios por intervalo
+        self.socios_by_range = False
+        
+        # Último CNPJ gravado (chave do keyset), preservado entre partes de uma exportação
+        self.last_cnpj: str = None
+        
+        # Escrita em thread dedicada: o disco trabalha enquanto o próximo lote é consultado
+        self.write_executor: ThreadPoolExecutor = None
+        self.pending_write: Future = None
+        # Consulta do próximo lote em thread dedicada enquanto o atual é processado
+        self.fetch_executor: ThreadPoolExecutor = None
+        self.next_fetch: Future = None
+        # Trechos da busca de sócios em paralelo (conexões do pool)
+        self.socios_executor: ThreadPoolExecutor = None
         
     def connect_database(self):
         """Conecta ao banco de dados MySQL com configurações otimizadas"""
         try:
-            # Configurações otimizadas para pymysql
-            db_config = DATABASE_CONFIG.copy()
-            # Remover parâmetros não suportados pelo pymysql
-            for key in ["connection_timeout"]:
-                if key in db_config:
-                    del db_config[key]
-            
-            # Configurações adicionais para performance
-            db_config.update({
-                'autocommit': True,
-                'charset': 'utf8mb4',
-                'use_unicode': True,
-                'connect_timeout': 60,
-                'read_timeout': 300,
-                'write_timeout': 300
-            })
-            
-            self.connection = pymysql.connect(**db_config)
+            # Engine SQLAlchemy com pool compartilhado (URL.create escapa usuário e senha)
+            connection_url = URL.create(
+                f"mysql+{MYSQL_DRIVER}",
+                username=DATABASE_CONFIG['user'],
+                password=DATABASE_CONFIG['password'],
+                host=DATABASE_CONFIG['host'],
+                port=DATABASE_CONFIG['port'],
+                database=DATABASE_CONFIG['database'],
+                query={'charset': 'utf8mb4'}
+            )
+            self.engine = get_engine(connection_url)
             
-            # Engine SQLAlchemy otimizada
-            connection_string = (
-                f"mysql+pymysql://{DATABASE_CONFIG['user']}:"
-                f"{DATABASE_CONFIG['password']}@{DATABASE_CONFIG['host']}:"
+            # URL no formato do connectorx (usada só quando o pacote está instalado)
+            self.connectorx_url = (
+                f"mysql://{quote(DATABASE_CONFIG['user'], safe='')}:"
+                f"{quote(DATABASE_CONFIG['password'], safe='')}@{DATABASE_CONFIG['host']}:"
                 f"{DATABASE_CONFIG['port']}/{DATABASE_CONFIG['database']}"
-                f"?charset=utf8mb4&autocommit=true"
-            )
-            self.engine = create_engine(
-                connection_string,
-                pool_pre_ping=True,
-                pool_recycle=3600,
-                echo=False
             )
             
+            # Conexão DB-API emprestada do pool (devolvida em close_database)
+            self.connection = self.engine.raw_connection()
+            
             logger.info(
-                "Conectado ao banco MySQL: %s:%s/%s",
+                "Conectado ao banco MySQL: %s:%s/%s (driver: %s)",
                 DATABASE_CONFIG['host'],
                 DATABASE_CONFIG['port'],
-                DATABASE_CONFIG['database']
+                DATABASE_CONFIG['database'],
+                MYSQL_DRIVER
             )
         except Exception as e:
             logger.error("Erro ao conectar ao banco: %s", e)
@@ -97,38 +335,43 @@ class CNPJProcessorUltraOptimized:
     
     def close_database(self):
         """Fecha conexão com banco de dados"""
+        if self.write_executor is not None:
+            self.write_executor.shutdown(wait=True)
+            self.write_executor = None
+            self.pending_write = None
+        if self.next_fetch is not None:
+            # Prefetch ainda não iniciado é descartado (cancel_futures exige Python 3.9)
+            self.next_fetch.cancel()
+            self.next_fetch = None
+        if self.fetch_executor is not None:
+            self.fetch_executor.shutdown(wait=True)
+            self.fetch_executor = None
+        if self.socios_executor is not None:
+            self.socios_executor.shutdown(wait=True)
+            self.socios_executor = None
+        self.close_output_writers()
         if self.connection:
+            # Devolve a conexão ao pool; a engine é compartilhada e não é descartada
             self.connection.close()
-        if self.engine:
-            self.engine.dispose()
+            self.connection = None
         logger.info("Conexão com banco de dados fechada")
     
     def setup_ultra_optimization_settings(self):
-        """Configura otimizações ULTRA para consultas grandes"""
-        cursor = self.connection.cursor()
+        """
+        Configura otimizações ULTRA para consultas grandes
         
-        optimization_queries = [
-            # Configurações de buffer otimizadas
-            "SET SESSION sort_buffer_size = 512*1024*1024",  # 512MB
-            "SET SESSION join_buffer_size = 256*1024*1024",  # 256MB
-            "SET SESSION read_buffer_size = 128*1024*1024",  # 128MB
-            "SET SESSION read_rnd_buffer_size = 64*1024*1024",  # 64MB
-            
-            # Otimizações de consulta
-            "SET SESSION tmp_table_size = 256*1024*1024",  # 256MB
-            "SET SESSION max_heap_table_size = 256*1024*1024",  # 256MB
-            
-            # Configurações de thread (removido thread_cache_size - é variável global)
-            
-            # Otimizações de índice
-            "SET SESSION optimizer_switch = 'index_merge=on,index_merge_union=on,index_merge_sort_union=on'",
-        ]
+        As variáveis de sessão são aplicadas pela engine a cada conexão nova do
+        pool (apply_session_settings), valendo também para as leituras em
+        streaming, o prefetch e as buscas de sócios em paralelo.
+        """
+        cursor = self.connection.cursor()
         
-        for query in optimization_queries:
-            try:
-                cursor.execute(query)
-            except Exception as e:
-                logger.warning("Erro ao aplicar otimização: %s - %s", query, e)
+        # Índices disponíveis para os hints de consulta
+        cursor.execute(
+            "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'cnpj_estabelecimentos'"
+        )
+        self.available_indexes = {row[0] for row in cursor.fetchall()}
         
         cursor.close()
         logger.info("Configurações ULTRA de otimização aplicadas")
@@ -140,58 +383,98 @@ class CNPJProcessorUltraOptimized:
         # Carregar CNAEs
         cursor = self.connection.cursor()
         cursor.execute("SELECT cnae, descricao FROM cnpj_cnaes")
-        self.cnae_cache = {str(row[0]): row[1] for row in cursor.fetchall()}
+        self.cnae_cache = self.build_lookup_dict(cursor.fetchall())
         logger.info("Cache CNAEs carregado: %s registros", len(self.cnae_cache))
         
         # Carregar Municípios
         cursor.execute("SELECT codigo, municipio FROM cnpj_municipios")
-        self.municipio_cache = {str(row[0]): row[1] for row in cursor.fetchall()}
+        self.municipio_cache = self.build_lookup_dict(cursor.fetchall())
         logger.info("Cache Municípios carregado: %s registros", len(self.municipio_cache))
         
         # Carregar Países
         cursor.execute("SELECT codigo, pais FROM cnpj_paises")
-        self.pais_cache = {str(row[0]): row[1] for row in cursor.fetchall()}
+        self.pais_cache = self.build_lookup_dict(cursor.fetchall())
         logger.info("Cache Países carregado: %s registros", len(self.pais_cache))
         
+        # Carregar Qualificações de sócios (consultas de sócios dispensam o JOIN)
+        cursor.execute("SELECT codigo, qualificacao FROM cnpj_qualificacao_socios")
+        self.qualificacao_cache = self.build_lookup_dict(cursor.fetchall())
+        logger.info("Cache Qualificações carregado: %s registros", len(self.qualificacao_cache))
+        
         cursor.close()
         logger.info("Todos os caches pré-carregados com sucesso!")
     
+    def build_lookup_dict(self, rows) -> Dict[int, str]:
+        """Monta dicionário de lookup com chaves inteiras (mesmo tipo das colunas de código)"""
+        return {int(row[0]): row[1] for row in rows if str(row[0]).strip().isdigit()}
+    
     def get_total_count_optimized(self, filters_dict: Dict[str, Any] = None, 
-                                apply_limit: bool = True) -> int:
-        """Contagem otimizada usando índices"""
-        # Usar contagem aproximada para melhor performance
+                                apply_limit: bool = True, max_count: int = 0) -> int:
+        """
+        Contagem otimizada usando índices
+        
+        Com teto (max_count e/ou limite global de 200.000) a contagem é feita
+        sobre uma subconsulta com LIMIT: o servidor para de ler ao atingir o teto
+        em vez de percorrer todas as linhas que atendem aos filtros.
+        """
         query = """
-        SELECT COUNT(*) 
+        SELECT 1 
         FROM cnpj_estabelecimentos est
         WHERE est.cnpj_part1 IS NOT NULL
         """
+        params: List[Any] = []
         
         if filters_dict:
-            query = self.apply_filters_minimal(query, filters_dict)
+            query, params = self.apply_filters_minimal(query, filters_dict)
+        
+        # Limitar ao máximo global de 200.000 registros se solicitado
+        if apply_limit:
+            max_limit = 200000
+            max_count = min(max_count, max_limit) if max_count > 0 else max_limit
         
-        # Adicionar LIMIT para acelerar contagem quando há filtros
-        if filters_dict and 'uf' in filters_dict:
-            query += " LIMIT 1000000"  # Limitar contagem para acelerar
+        if max_count > 0:
+            query = f"SELECT COUNT(*) FROM ({query} LIMIT %s) AS limitados"
+            params = params + [max_count]
+        else:
+            query = f"SELECT COUNT(*) FROM ({query}) AS todos"
         
         cursor = self.connection.cursor()
-        cursor.execute(query)
+        cursor.execute(query, params)
         total = cursor.fetchone()[0]
         cursor.close()
         
-        # Limitar ao máximo global de 200.000 registros se solicitado
-        if apply_limit:
-            max_limit = 200000
-            return min(total, max_limit)
-        else:
-            return total
+        return total
     
-    def apply_filters_minimal(self, query: str, filters_dict: Dict[str, Any]) -> str:
-        """Aplica apenas filtros essenciais para máxima performance"""
+    def estimate_total_count(self) -> int:
+        """
+        Estimativa O(1) do total de estabelecimentos (TABLE_ROWS do information_schema)
+        
+        É um limite superior aproximado, sem filtros: serve apenas para progresso.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'cnpj_estabelecimentos'"
+        )
+        row = cursor.fetchone()
+        cursor.close()
+        return int(row[0]) if row and row[0] is not None else 0
+    
+    def apply_filters_minimal(self, query: str, filters_dict: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        """
+        Aplica apenas filtros essenciais para máxima performance
+        
+        Os valores dos filtros nunca são interpolados no SQL: são retornados
+        como parâmetros (%s) para o driver, mantendo o texto da consulta
+        estável para o mesmo conjunto de filtros.
+        """
         where_conditions = []
+        params: List[Any] = []
         
         # Filtros mais comuns e com índices
         if "uf" in filters_dict:
-            where_conditions.append(f"est.uf = '{filters_dict['uf']}'")
+            where_conditions.append("est.uf = %s")
+            params.append(filters_dict["uf"])
         
         if "situacao_cadastral" in filters_dict:
             situacao = filters_dict["situacao_cadastral"]
@@ -203,85 +486,53 @@ class CNPJProcessorUltraOptimized:
                 where_conditions.append("est.situacao_cadastral IN (1, 3, 8)")
         
         if "codigo_municipio" in filters_dict:
-            where_conditions.append(f"est.codigo_municipio = {filters_dict['codigo_municipio']}")
+            where_conditions.append("est.codigo_municipio = %s")
+            params.append(filters_dict["codigo_municipio"])
         
         if "cnae_codes" in filters_dict:
-            cnae_list = "','".join(filters_dict["cnae_codes"])
-            where_conditions.append(f"est.cnae IN ('{cnae_list}')")
+            cnae_codes = list(filters_dict["cnae_codes"])
+            placeholders = ", ".join(["%s"] * len(cnae_codes))
+            where_conditions.append(f"est.cnae IN ({placeholders})")
+            params.extend(cnae_codes)
         
         # Aplicar condições WHERE
         if where_conditions:
             where_clause = " AND ".join(where_conditions)
             query += f" AND {where_clause}"
         
-        return query
+        return query, params
     
-    def build_ultra_optimized_query(self, limit: int = 0, offset: int = 0, filters_query: Dict[str, Any] = None, last_cnpj: str = None) -> str:
+    def build_ultra_optimized_query(self, limit: int = 0, filters_query: Dict[str, Any] = None,
+                                    last_cnpj: str = None) -> Tuple[str, List[Any]]:
         """
         Constrói consulta ULTRA otimizada com mínimos JOINs
+        
+        Paginação por keyset (seek): last_cnpj é o CNPJ completo (14 dígitos) do
+        último registro do lote anterior; nunca é usado OFFSET.
+        
+        Retorna a consulta e a lista de parâmetros a serem passados ao driver.
         """
-        # Query ultra otimizada - apenas JOINs essenciais
-        query = """
-        SELECT 
-            CONCAT(
-                LPAD(est.cnpj_part1, 8, '0'), 
-                LPAD(est.cnpj_part2, 4, '0'), 
-                LPAD(est.cnpj_part3, 2, '0')
-            ) as cnpj,
-            est.identificador_matriz_filial,
-            e.razao_social,
-            est.nome_fantasia,
-            est.situacao_cadastral,
-            est.data_situacao_cadastral,
-            est.motivo_situacao_cadastral,
-            est.cidade_estrangeira,
-            est.codigo_pais,
-            est.data_inicio_atividade,
-            est.cnae,
-            est.tipo_logradouro,
-            est.logradouro,
-            est.numero,
-            est.complemento,
-            est.bairro,
-            est.cep,
-            est.uf,
-            est.codigo_municipio,
-            est.ddd1,
-            est.telefone1,
-            est.ddd2,
-            est.telefone2,
-            est.ddd_fax,
-            est.fax,
-            est.correio_eletronico,
-            e.qualificacao_socio,
-            e.capital_social,
-            e.porte_empresa,
-            s.opcao_simples,
-            s.data_opcao_simples,
-            s.data_exclusao_simples,
-            s.opcao_mei,
-            est.situacao_especial,
-            est.data_situacao_especial,
-            est.cnaes_secundarios,
-            s.data_opcao_mei,
-            s.data_exclusao_opcao_mei
-        FROM cnpj_estabelecimentos est
-        INNER JOIN cnpj_empresas e ON est.cnpj_part1 = e.cnpj_part1
-        LEFT JOIN cnpj_simples s ON e.cnpj_part1 = s.cnpj_part1
-        WHERE est.cnpj_part1 IS NOT NULL
-        """
+        query = BASE_QUERY_ULTRA
+        
+        params: List[Any] = []
         
-        # Aplicar filtros
+        # Aplicar filtros (com hint de índice que já entrega a ordem do keyset)
         if filters_query:
-            query = self.apply_filters_minimal(query, filters_query)
+            index_hint = self.index_hint_ultra(filters_query)
+            if index_hint:
+                query = query.replace(
+                    "FROM cnpj_estabelecimentos est",
+                    f"FROM cnpj_estabelecimentos est {index_hint}",
+                    1
+                )
+            query, params = self.apply_filters_minimal(query, filters_query)
         
-        # Usar cursor-based pagination para melhor performance
+        # Continuar a partir da chave (cnpj_part1, cnpj_part2, cnpj_part3) do último registro
         if last_cnpj:
-            # Continuar a partir do último CNPJ processado
-            query += f" AND est.cnpj_part1 > '{last_cnpj}'"
+            query, params = self.apply_keyset_cursor(query, params, last_cnpj)
         
-        # Ordenação por CNPJ para cursor-based pagination
-        query += " ORDER BY est.cnpj_part1"
+        # Ordenação pela chave completa do CNPJ (estável para o keyset)
+        query += " ORDER BY est.cnpj_part1, est.cnpj_part2, est.cnpj_part3"
         
         # Limite global máximo de 200.000 registros
         max_limit = 200000
@@ -293,7 +544,128 @@ class CNPJProcessorUltraOptimized:
         if actual_limit > 0:
             query += f" LIMIT {actual_limit}"
         
-        return query
+        return query, params
+    
+    def index_hint_ultra(self, filters_dict: Dict[str, Any]) -> str:
+        """
+        Escolhe o hint de índice para a combinação de filtros
+        
+        Com igualdade em (uf | codigo_municipio) e situação de valor único, os índices
+        *_situacao_keyset já entregam as linhas na ordem do keyset (sem filesort).
+        Só indica índices presentes no banco (ver data/sql/indexes-keyset.sql).
+        """
+        if filters_dict.get("situacao_cadastral") not in ("ativos", "inaptos"):
+            return ""
+        
+        if "codigo_municipio" in filters_dict:
+            index_name = "idx_estabelecimentos_municipio_situacao_keyset"
+        elif "uf" in filters_dict:
+            index_name = "idx_estabelecimentos_uf_situacao_keyset"
+        else:
+            return ""
+        
+        if index_name not in self.available_indexes:
+            return ""
+        return f"USE INDEX ({index_name})"
+    
+    def apply_keyset_cursor(self, query: str, params: List[Any], last_cnpj: str) -> Tuple[str, List[Any]]:
+        """Adiciona a condição de seek após o CNPJ informado (14 dígitos)"""
+        part1, part2, part3 = last_cnpj[:8], last_cnpj[8:12], last_cnpj[12:14]
+        # A condição redundante em cnpj_part1 permite range scan no índice
+        query += (
+            " AND est.cnpj_part1 >= %s"
+            " AND (est.cnpj_part1, est.cnpj_part2, est.cnpj_part3) > (%s, %s, %s)"
+        )
+        return query, params + [part1, part1, part2, part3]
+    
+    def find_cnpj_before_offset(self, offset: int, filters_dict: Dict[str, Any] = None) -> str:
+        """
+        Localiza o CNPJ imediatamente anterior à posição `offset`
+        
+        Usado apenas para iniciar uma execução avulsa a partir de um offset;
+        execuções sequenciais reaproveitam self.last_cnpj sem varredura.
+        """
+        if offset <= 0:
+            return None
+        
+        query = """
+        SELECT CONCAT(
+            LPAD(est.cnpj_part1, 8, '0'), 
+            LPAD(est.cnpj_part2, 4, '0'), 
+            LPAD(est.cnpj_part3, 2, '0')
+        )
+        FROM cnpj_estabelecimentos est
+        INNER JOIN cnpj_empresas e ON est.cnpj_part1 = e.cnpj_part1
+        WHERE est.cnpj_part1 IS NOT NULL
+        """
+        params: List[Any] = []
+        if filters_dict:
+            query, params = self.apply_filters_minimal(query, filters_dict)
+        query += f" ORDER BY est.cnpj_part1, est.cnpj_part2, est.cnpj_part3 LIMIT 1 OFFSET {int(offset) - 1}"
+        
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        
+        return row[0] if row else None
+    
+    def read_batch_ultra(self, query: str, params: List[Any]) -> pd.DataFrame:
+        """Lê o lote com stream_results (SSCursor), evitando o buffer duplicado do resultado"""
+        if logger.isEnabledFor(logging.DEBUG):
+            self.explain_query_ultra(query, params)
+        
+        if cx is not None:
+            # connectorx não aceita parâmetros: valores escapados como literais SQL pelo
+            # pymysql, sem conexão (roda na thread de prefetch)
+            literal_params = [escape_item(value, 'utf8mb4') for value in params]
+            table = cx.read_sql(self.connectorx_url, query % tuple(literal_params), return_type='arrow')
+            return table.to_pandas(types_mapper=pd.ArrowDtype)
+        
+        with self.engine.connect().execution_options(stream_results=True) as conn:
+            return pd.read_sql(query, conn, params=tuple(params), dtype_backend='pyarrow')
+    
+    def iter_batches_ultra(self, query: str, params: List[Any], chunksize: int):
+        """Executa a consulta uma única vez e entrega DataFrames de `chunksize` linhas (streaming)"""
+        if logger.isEnabledFor(logging.DEBUG):
+            self.explain_query_ultra(query, params)
+        
+        with self.engine.connect().execution_options(
+            stream_results=True, max_row_buffer=chunksize
+        ) as conn:
+            yield from pd.read_sql(
+                query, conn, params=tuple(params), chunksize=chunksize, dtype_backend='pyarrow'
+            )
+    
+    def explain_query_ultra(self, query: str, params: List[Any]):
+        """Registra o plano (EXPLAIN FORMAT=JSON) e avisa sobre varreduras completas de tabela"""
+        # Conexão própria do pool: pode rodar na thread de prefetch
+        try:
+            with self.engine.connect() as conn:
+                row = conn.exec_driver_sql("EXPLAIN FORMAT=JSON " + query, tuple(params)).fetchone()
+            plan = json.loads(row[0])
+        except Exception as e:
+            logger.debug("Não foi possível obter o EXPLAIN da consulta: %s", e)
+            return
+        
+        logger.debug("Plano da consulta: %s", json.dumps(plan))
+        
+        # Percorrer o plano procurando tabelas com access_type ALL (full scan)
+        pending = [plan]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, dict):
+                if node.get('access_type') == 'ALL':
+                    logger.warning(
+                        "⚠️ Full scan na tabela %s (linhas estimadas: %s) - verifique os índices em data/sql/ddls.sql",
+                        node.get('table_name'),
+                        node.get('rows_examined_per_scan')
+                    )
+                pending.extend(node.values())
+            elif isinstance(node, list):
+                pending.extend(node)
     
     def get_optimized_order_by(self, filters_query: Dict[str, Any] = None) -> str:
         """
@@ -338,120 +710,252 @@ class CNPJProcessorUltraOptimized:
         
         logger.debug("Buscando sócios diretamente para %s CNPJs", len(cnpj_batch))
         
-        # Batch size otimizado para lotes menores
+        # Lote contíguo na ordem do CNPJ: uma única varredura do intervalo no índice
+        if self.socios_by_range:
+            try:
+                results = self.format_socios_ultra(
+                    self.fetch_socios_range(min(cnpj_batch), max(cnpj_batch))
+                )
+                logger.debug("Busca de sócios (intervalo) concluída: %s CNPJs, %s com sócios",
+                            len(cnpj_batch), len(results))
+                return results
+            except Exception as e:
+                logger.warning("Falha na busca de sócios por intervalo (%s), usando busca por chaves", e)
+        
+        # Muitas chaves: uma única consulta com JOIN numa tabela temporária
+        if len(cnpj_batch) > 5000:
+            try:
+                results = self.format_socios_ultra(self.fetch_socios_temp_table(cnpj_batch))
+                logger.debug("Busca de sócios (tabela temporária) concluída: %s CNPJs, %s com sócios",
+                            len(cnpj_batch), len(results))
+                return results
+            except Exception as e:
+                logger.warning("Falha na busca via tabela temporária (%s), usando listas IN", e)
+        
+        # Batch size otimizado para lotes menores (limita o tamanho da lista IN)
         if len(cnpj_batch) > 2000:
             batch_size = 500  # Batch menor para lotes grandes
         else:
             batch_size = 1000  # Batch normal
         
-        results = {}
+        chunks = [cnpj_batch[i:i + batch_size] for i in range(0, len(cnpj_batch), batch_size)]
+        rows = []
         
-        for i in range(0, len(cnpj_batch), batch_size):
-            batch = cnpj_batch[i:i + batch_size]
-            placeholders = ','.join(['%s' for _ in batch])
-            
-            query = f"""
-            SELECT 
-                soc.cnpj_part1,
-                GROUP_CONCAT(
-                    CONCAT(
-                        'ID: ', IFNULL(soc.identificador_socio, ''), 
-                        ' | Nome: ', IFNULL(soc.nome_socio, ''), 
-                        ' | Qualificação: ', IFNULL(qs.qualificacao, ''), 
-                        ' | Data Entrada: ', IFNULL(soc.data_entrada_sociedade, '')
-                    ) 
-                    SEPARATOR ' | '
-                ) as socios_info
-            FROM cnpj_socios soc
-            LEFT JOIN cnpj_qualificacao_socios qs ON soc.codigo_qualificacao_socio = qs.codigo
-            WHERE soc.cnpj_part1 IN ({placeholders})
-            GROUP BY soc.cnpj_part1
-            """
-            
-            try:
-                cursor = self.connection.cursor()
-                cursor.execute(query, batch)
-                batch_results = cursor.fetchall()
-                cursor.close()
-                
-                # Adicionar resultados
-                for row in batch_results:
-                    socios_info = row[1] if row[1] else ""
-                    results[row[0]] = socios_info
-                    
-                logger.debug("Batch %s/%s de sócios processado: %s resultados", 
-                           i//batch_size + 1, (len(cnpj_batch) + batch_size - 1)//batch_size, len(batch_results))
-                    
-            except Exception as e:
-                logger.error("Erro na busca de sócios para batch %s: %s", i//batch_size + 1, e)
-                # Tentar novamente com batch menor
-                if batch_size > 100:
-                    logger.warning("Tentando novamente com batch size menor...")
-                    batch_size = batch_size // 2
-                    i -= batch_size  # Voltar para tentar novamente
-                    continue
-                else:
-                    logger.error("Falha crítica na busca de sócios, continuando sem este batch")
-                    continue
+        if len(chunks) == 1 or self.engine is None:
+            for chunk in chunks:
+                rows.extend(self.query_socios_in_list(chunk, self.connection))
+        else:
+            # Trechos independentes em paralelo, cada um com sua conexão do pool
+            if self.socios_executor is None:
+                self.socios_executor = ThreadPoolExecutor(
+                    max_workers=SOCIOS_PARALLEL_WORKERS, thread_name_prefix='cnpj-socios'
+                )
+            for chunk_rows in self.socios_executor.map(self.fetch_socios_chunk_pooled, chunks):
+                rows.extend(chunk_rows)
+        
+        results = self.format_socios_ultra(rows)
         
         logger.debug("Busca de sócios concluída: %s CNPJs processados, %s com sócios encontrados", 
                     len(cnpj_batch), len(results))
         return results
     
-    def adjust_batch_size(self, batch_time: float, current_batch_size: int) -> int:
+    def fetch_socios_chunk_pooled(self, batch: List[str]) -> List[Tuple]:
+        """Busca um trecho de sócios numa conexão própria do pool (uso em threads)"""
+        connection = self.engine.raw_connection()
+        try:
+            return self.query_socios_in_list(batch, connection)
+        finally:
+            connection.close()
+    
+    def query_socios_in_list(self, batch: List[str], connection) -> List[Tuple]:
+        """Busca as linhas de sócios de um trecho (lista IN); erro de tamanho/tempo divide o trecho ao meio"""
+        placeholders = ','.join(['%s'] * len(batch))
+        
+        # Linhas cruas (sem GROUP_CONCAT): evita truncamento por group_concat_max_len
+        query = f"""
+        SELECT 
+            soc.cnpj_part1,
+            soc.identificador_socio,
+            soc.nome_socio,
+            soc.codigo_qualificacao_socio,
+            soc.data_entrada_sociedade
+        FROM cnpj_socios soc
+        WHERE soc.cnpj_part1 IN ({placeholders})
+        """
+        
+        cursor = connection.cursor()
+        try:
+            cursor.execute(query, batch)
+            batch_results = list(cursor.fetchall())
+        except Exception as e:
+            logger.error("Erro na busca de sócios (%s CNPJs): %s", len(batch), e)
+            error_code = e.args[0] if e.args and isinstance(e.args[0], int) else None
+            if error_code not in SOCIOS_SPLIT_RETRY_ERRORS:
+                raise
+            # Tentar novamente o mesmo trecho com batch menor
+            if len(batch) > 100:
+                half = len(batch) // 2
+                logger.warning("Tentando novamente com batch size %s...", half)
+                return (self.query_socios_in_list(batch[:half], connection)
+                        + self.query_socios_in_list(batch[half:], connection))
+            logger.error("Falha crítica na busca de sócios, continuando sem este batch")
+            return []
+        finally:
+            cursor.close()
+        
+        logger.debug("Batch de sócios processado: %s CNPJs, %s resultados", len(batch), len(batch_results))
+        return batch_results
+    
+    def fetch_socios_range(self, first_cnpj: str, last_cnpj: str) -> List[Tuple]:
+        """Busca os sócios de todo o intervalo de cnpj_part1 do lote (range scan em idx_socios_cnpj)"""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute("""
+            SELECT 
+                soc.cnpj_part1,
+                soc.identificador_socio,
+                soc.nome_socio,
+                soc.codigo_qualificacao_socio,
+                soc.data_entrada_sociedade
+            FROM cnpj_socios soc
+            WHERE soc.cnpj_part1 BETWEEN %s AND %s
+            """, (first_cnpj, last_cnpj))
+            return list(cursor.fetchall())
+        finally:
+            cursor.close()
+    
+    def fetch_socios_temp_table(self, cnpj_batch: List[str]) -> List[Tuple]:
+        """Carrega as chaves numa tabela temporária (executemany) e busca os sócios com um JOIN"""
+        cursor = self.connection.cursor()
+        try:
+            # Tabela temporária da sessão: reaproveitada entre lotes, esvaziada a cada uso
+            cursor.execute(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS tmp_socios_keys "
+                "(cnpj_part1 VARCHAR(8) NOT NULL PRIMARY KEY)"
+            )
+            cursor.execute("DELETE FROM tmp_socios_keys")
+            cursor.executemany(
+                "INSERT IGNORE INTO tmp_socios_keys (cnpj_part1) VALUES (%s)",
+                [(cnpj,) for cnpj in cnpj_batch]
+            )
+            cursor.execute("""
+            SELECT 
+                soc.cnpj_part1,
+                soc.identificador_socio,
+                soc.nome_socio,
+                soc.codigo_qualificacao_socio,
+                soc.data_entrada_sociedade
+            FROM tmp_socios_keys k
+            INNER JOIN cnpj_socios soc ON soc.cnpj_part1 = k.cnpj_part1
+            """)
+            return list(cursor.fetchall())
+        finally:
+            cursor.close()
+    
+    def format_socios_ultra(self, rows: List[Tuple]) -> Dict[str, str]:
+        """Monta o texto de sócios por cnpj_part1 com concatenação vetorizada e groupby"""
+        if not rows:
+            return {}
+        
+        socios_df = pd.DataFrame(
+            rows,
+            columns=['cnpj_part1', 'identificador_socio', 'nome_socio', 'codigo_qualificacao_socio',
+                     'data_entrada_sociedade'],
+            dtype=object
+        )
+        # Descrição da qualificação pelo cache pré-carregado (chaves inteiras)
+        socios_df['qualificacao'] = pd.to_numeric(socios_df.pop('codigo_qualificacao_socio')).map(
+            self.qualificacao_cache
+        )
+        texto = {col: socios_df[col].astype('string').fillna('') for col in socios_df.columns[1:]}
+        socios_df['socio'] = (
+            'ID: ' + texto['identificador_socio']
+            + ' | Nome: ' + texto['nome_socio']
+            + ' | Qualificação: ' + texto['qualificacao']
+            + ' | Data Entrada: ' + texto['data_entrada_sociedade']
+        )
+        
+        return socios_df.groupby('cnpj_part1', sort=False)['socio'].agg(' | '.join).to_dict()
+    
+    def adjust_batch_size(self, batch_time: float, current_batch_size: int, batch_records: int = 0) -> int:
         """
         Ajusta dinamicamente o tamanho do lote baseado na performance
+        
+        Controlador proporcional sobre a média móvel (EMA) da duração dos lotes:
+        o tamanho converge para o que leva target_batch_time segundos, variando
+        no máximo 2x por lote. Só cresce enquanto a vazão (registros/s) não cai.
         """
-        # Se o lote demorar mais de 15 segundos, reduzir tamanho
-        if batch_time > 15:
-            new_size = max(self.min_batch_size, current_batch_size // 2)
-            logger.warning("Lote muito lento (%.2fs), reduzindo tamanho: %s -> %s", 
-                         batch_time, f"{current_batch_size:,}", f"{new_size:,}")
-            return new_size
-        
-        # Se o lote for muito rápido (< 5s) e não estiver no máximo, aumentar
-        elif batch_time < 5 and current_batch_size < self.max_batch_size:
-            new_size = min(self.max_batch_size, int(current_batch_size * 1.5))
-            logger.info("Lote muito rápido (%.2fs), aumentando tamanho: %s -> %s", 
-                      batch_time, f"{current_batch_size:,}", f"{new_size:,}")
-            return new_size
-        
-        return current_batch_size
+        throughput = batch_records / batch_time if batch_time > 0 else 0.0
+        previous_throughput, self.last_throughput = self.last_throughput, throughput
+        
+        # EMA amortece a variação de um lote isolado (cache frio, pausa do servidor)
+        if self.batch_time_ema <= 0:
+            self.batch_time_ema = batch_time
+        else:
+            self.batch_time_ema = 0.7 * self.batch_time_ema + 0.3 * batch_time
+        
+        new_size = int(current_batch_size * self.target_batch_time / max(self.batch_time_ema, 0.1))
+        
+        # Crescer apenas enquanto a vazão se mantém (tolerância de 5%)
+        if new_size > current_batch_size and throughput < previous_throughput * 0.95:
+            new_size = current_batch_size
+        
+        new_size = min(max(new_size, current_batch_size // 2), current_batch_size * 2)
+        new_size = max(new_size, self.min_batch_size)
+        # Teto aplicado só ao crescer: um lote configurado acima do máximo não é cortado
+        if new_size > current_batch_size:
+            new_size = min(new_size, max(self.max_batch_size, current_batch_size))
+        
+        if new_size != current_batch_size:
+            logger.info("Lote %.2fs (média %.2fs, %.0f reg/s), ajustando tamanho: %s -> %s", 
+                      batch_time, self.batch_time_ema, throughput,
+                      f"{current_batch_size:,}", f"{new_size:,}")
+        
+        return new_size
     
     def cleanup_resources_after_batch(self):
         """Libera recursos mínimos após cada lote"""
         import gc
         
-        # Apenas garbage collection leve
-        gc.collect()
+        # Apenas garbage collection leve: gerações jovens, onde ficam os ciclos de cada lote;
+        # a coleta completa percorreria todo o heap (caches de lookup inclusive)
+        gc.collect(1)
+        
+        # Devolver ao SO as páginas livres (buffers NumPy via malloc e pool do Arrow),
+        # mantendo o RSS estável em execuções longas
+        pa.default_memory_pool().release_unused()
+        if LIBC is not None:
+            LIBC.malloc_trim(0)
         
         logger.debug("Recursos básicos liberados após lote")
     
-    def process_batch_ultra_optimized(self, batch_data: pd.DataFrame) -> pd.DataFrame:
+    def process_batch_ultra_optimized(self, batch_data: pd.DataFrame, start_id: int = 1) -> pd.DataFrame:
         """Processa lote com máxima otimização usando caches pré-carregados"""
         if batch_data.empty:
             return batch_data
         
         # Processar dados básicos primeiro (incluindo correção do código do país)
-        batch_data = self.process_dataframe_ultra(batch_data)
+        batch_data = self.process_dataframe_ultra(batch_data, start_id=start_id)
         
         # Aplicar lookups usando caches pré-carregados (após correção do código do país)
-        batch_data['cnae_fiscal'] = batch_data['cnae_codes'].astype(str).map(self.cnae_cache)
-        batch_data['municipio'] = batch_data['codigo_municipio'].astype(str).map(self.municipio_cache)
-        batch_data['pais'] = batch_data['codigo_pais'].astype(str).map(self.pais_cache)
+        # Chaves inteiras: map direto na coluna numérica, sem converter cada linha para str
+        batch_data['cnae_fiscal'] = batch_data['cnae_codes'].map(self.cnae_cache)
+        batch_data['municipio'] = batch_data['codigo_municipio'].map(self.municipio_cache)
+        batch_data['pais'] = batch_data['codigo_pais'].map(self.pais_cache)
         
         # Reordenar colunas após adicionar todas as colunas necessárias
         batch_data = self.reorder_columns_ultra(batch_data)
         
         # Buscar sócios em lote de forma direta (SEMPRE buscar sócios - dados essenciais)
-        # Extrair cnpj_part1 da coluna cnpj para buscar sócios
-        cnpj_part1_list = batch_data['cnpj'].str[:8].unique().tolist()
+        # Extrair cnpj_part1 da coluna cnpj uma única vez (string Arrow, sem object)
+        cnpj_part1 = batch_data['cnpj'].astype('string').str.slice(0, 8)
+        cnpj_part1_list = cnpj_part1.unique().tolist()
         
         logger.debug("Buscando sócios diretamente para %s CNPJs únicos", len(cnpj_part1_list))
         
-        socios_start = time.time()
+        socios_start = time.perf_counter()
         socios_data = self.get_socios_batch_direct(cnpj_part1_list)
-        socios_time = time.time() - socios_start
+        socios_time = time.perf_counter() - socios_start
         
         logger.debug("Busca de sócios concluída em %.2fs", socios_time)
         
@@ -460,47 +964,58 @@ class CNPJProcessorUltraOptimized:
             logger.warning("Busca de sócios muito lenta (%.2fs), reduzindo tamanho do lote principal", socios_time)
             self.batch_size = max(self.min_batch_size, self.batch_size // 2)
         
-        batch_data['socios'] = batch_data['cnpj'].str[:8].map(socios_data).fillna("")
+        batch_data['socios'] = cnpj_part1.map(socios_data).fillna("")
         
         return batch_data
     
-    def process_dataframe_ultra(self, df: pd.DataFrame) -> pd.DataFrame:
+    def process_dataframe_ultra(self, df: pd.DataFrame, start_id: int = 1) -> pd.DataFrame:
         """Processa DataFrame com otimizações ULTRA"""
         if df.empty:
             return df
         
-        # Adicionar ID sequencial
-        df['id'] = range(1, len(df) + 1)
+        # Reduzir footprint de memória do lote antes das transformações
+        df = self.optimize_dtypes_ultra(df)
+        
+        # Adicionar ID sequencial contínuo entre lotes (gerado no pandas, não no SQL)
+        df.insert(0, 'id', np.arange(start_id, start_id + len(df), dtype=np.int64))
         
         # CNPJ já vem formatado da query SQL como string
         
         # Renomear colunas
-        df = df.rename(columns={
-            'identificador_matriz_filial': 'identificador_m_f',
-            'motivo_situacao_cadastral': 'motivo_situacao_cadastral',
-            'cidade_estrangeira': 'nome_cidade_exterior',
-            'natureza_juridica': 'codigo_natureza_juridica',
-            'cnae': 'cnae_codes',
-            'ddd1': 'ddd_telefone_1',
-            'telefone1': 'telefone1_celular',
-            'ddd2': 'ddd_telefone_2',
-            'telefone2': 'telefone2_celular',
-            'correio_eletronico': 'email',
-            'qualificacao_socio': 'qualificacao_responsavel',
-            'capital_social': 'capital_social_empresa',
-            'porte_empresa': 'porte_empresa'
-        })
+        df = df.rename(columns=COLUMNS_MAPPING_ULTRA)
         
         # Aplicar processamentos específicos
         df = self.apply_data_processing_ultra(df)
         
         return df
     
+    def optimize_dtypes_ultra(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Converte colunas de baixa cardinalidade para category e faz downcast de inteiros"""
+        for col in ('uf', 'porte_empresa', 'opcao_simples', 'opcao_mei'):
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+        
+        # Downcast apenas de colunas já inteiras, preservando zeros à esquerda de textos.
+        # Larguras fixas: o tipo não varia entre lotes (schema estável no Parquet)
+        for col, dtype in INTEGER_DOWNCAST_DTYPES.items():
+            if col in df.columns and pd.api.types.is_integer_dtype(df[col]):
+                if isinstance(df[col].dtype, pd.ArrowDtype):
+                    df[col] = df[col].astype(f'{dtype}[pyarrow]')
+                elif not df[col].hasnans:
+                    df[col] = df[col].astype(dtype)
+        
+        return df
+    
     def reorder_columns_ultra(self, df: pd.DataFrame) -> pd.DataFrame:
         """Reordena colunas para colocar 'pais' logo depois de 'codigo_pais', 'municipio' logo depois de 'codigo_municipio' e 'cnae_codes' logo antes de 'cnae_fiscal'"""
         if df.empty:
             return df
         
+        # Todos os lotes têm as mesmas colunas: reaproveitar a ordem já calculada
+        input_columns = tuple(df.columns)
+        if input_columns == self.input_columns:
+            return df[self.output_columns]
+        
         # Obter lista de colunas
         columns = df.columns.tolist()
         
@@ -537,6 +1052,9 @@ class CNPJProcessorUltraOptimized:
             # Inserir 'cnae_codes' logo antes de 'cnae_fiscal'
             columns.insert(cnae_fiscal_idx, 'cnae_codes')
         
+        self.input_columns = input_columns
+        self.output_columns = columns
+        
         # Reordenar DataFrame
         df = df[columns]
         
@@ -544,86 +1062,174 @@ class CNPJProcessorUltraOptimized:
     
     def apply_data_processing_ultra(self, df: pd.DataFrame) -> pd.DataFrame:
         """Aplica processamentos específicos com otimizações"""
-        # Detectar celulares
-        df['telefone1_celular'] = df.apply(self.detect_celular_ultra, axis=1, args=('telefone1_celular', 'ddd_telefone_1'))
-        df['telefone2_celular'] = df.apply(self.detect_celular_ultra, axis=1, args=('telefone2_celular', 'ddd_telefone_2'))
+        # Detectar celulares (vetorizado, sem df.apply linha a linha)
+        df['telefone1_celular'] = self.detect_celular_ultra(df['telefone1_celular'], df['ddd_telefone_1'])
+        df['telefone2_celular'] = self.detect_celular_ultra(df['telefone2_celular'], df['ddd_telefone_2'])
         
         # Validar emails
-        df['email'] = df['email'].apply(self.validate_email_ultra)
-        
-        # Corrigir situação cadastral
-        df['situacao_cadastral'] = df['situacao_cadastral'].replace({
-            2: 'ATIVA',
-            4: 'INAPTA',
-            8: 'SUSPENSA'
-        })
-        
-        # Corrigir código do país
-        df['codigo_pais'] = df['codigo_pais'].replace(0, 105)
+        df['email'] = self.validate_email_ultra(df['email'])
         
-        # Concatenação DDD + Fax
-        df['ddd_fax'] = df['ddd_fax'].astype(str) + df['fax'].astype(str)
+        # Corrigir situação cadastral (map vetorizado; códigos sem rótulo mantêm o número)
+        codigos = df['situacao_cadastral']
+        situacao = codigos.map(SITUACAO_CADASTRAL_LABELS)
+        if pd.api.types.is_numeric_dtype(codigos):
+            codigos = codigos.astype('Int64')
+        df['situacao_cadastral'] = situacao.fillna(codigos.astype('string')).astype('category')
         
         return df
     
-    def detect_celular_ultra(self, row, telefone_col: str, ddd_col: str) -> str:
-        """Detecta se telefone é celular com otimização"""
-        telefone = str(row[telefone_col])
-        ddd = str(row[ddd_col])
-        
-        if len(telefone) == 9 and telefone[0] in ['9']:
-            return f"({ddd}) {telefone}"
-        return ""
+    def detect_celular_ultra(self, telefones: pd.Series, ddds: pd.Series) -> pd.Series:
+        """Detecta celulares (9 dígitos iniciando em 9) e formata como '(DDD) telefone'"""
+        # Colunas numéricas com nulos chegam como float: passar por Int64 evita '11.0'
+        if pd.api.types.is_float_dtype(ddds):
+            ddds = ddds.astype('Int64')
+        if pd.api.types.is_float_dtype(telefones):
+            telefones = telefones.astype('Int64')
+        telefones = telefones.astype('string')
+        ddds = ddds.astype('string')
+        
+        # Vazio quando DDD ou telefone é nulo (máscara única, sem pd.notna por linha)
+        is_celular = (telefones.str.len() == 9) & telefones.str.startswith('9') & ddds.notna()
+        is_celular = is_celular.fillna(False).astype(bool)
+        
+        return ('(' + ddds + ') ' + telefones).where(is_celular, '')
     
-    def validate_email_ultra(self, email: str) -> str:
-        """Valida formato de email com otimização"""
-        if pd.isna(email) or email == '':
-            return ""
+    def validate_email_ultra(self, emails: pd.Series) -> pd.Series:
+        """Valida formato dos emails da coluna inteira (regex pré-compilada, sem apply)"""
+        emails = emails.astype('string').fillna('')
+        return emails.where(emails.str.match(EMAIL_PATTERN, na=False), '')
+    
+    def dataframe_to_arrow_ultra(self, df: pd.DataFrame) -> pa.Table:
+        """Converte o DataFrame do lote em tabela Arrow para escrita em C++"""
+        # Colunas object podem misturar tipos (ex.: 'ATIVA' e 3 em situacao_cadastral),
+        # o que o Arrow não aceita: normalizar para string antes da conversão
+        object_columns = [col for col in df.columns if df[col].dtype == object]
+        if object_columns:
+            df = df.astype({col: 'string' for col in object_columns})
+        
+        return pa.Table.from_pandas(df, preserve_index=False)
+    
+    def save_to_csv_ultra(self, df: pd.DataFrame, output_path: str, append: bool = False,
+                          quoting: str = None):
+        """
+        Salva DataFrame em CSV com otimizações ULTRA (writer CSV do PyArrow)
         
-        email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        if re.match(email_pattern, email):
-            return email
-        return ""
-    
-    def save_to_csv_ultra(self, df: pd.DataFrame, output_path: str, append: bool = False):
-        """Salva DataFrame em CSV com otimizações ULTRA"""
-        mode = 'a' if append else 'w'
-        header = not append
-        
-        # Otimizações para CSV
-        df.to_csv(
-            output_path, 
-            sep=';', 
-            index=False, 
-            quoting=csv.QUOTE_ALL, 
-            encoding='utf-8',
-            mode=mode,
-            header=header,
-            chunksize=10000  # Processar em chunks para economizar memória
+        quoting: 'minimal' (aspas só em textos) ou 'all' (todos os valores);
+        padrão em OUTPUT_CONFIG['csv_quoting']
+        """
+        mode = 'ab' if append else 'wb'
+        quoting = quoting or OUTPUT_CONFIG['csv_quoting']
+        
+        table = self.dataframe_to_arrow_ultra(df)
+        write_options = pacsv.WriteOptions(
+            include_header=not append,
+            delimiter=';',
+            quoting_style='all_valid' if quoting == 'all' else 'needed'
         )
+        
+        if not append or self.csv_sink is None or self.csv_sink_path != output_path:
+            self.close_csv_sink()
+            if output_path.endswith('.gz'):
+                # Saída .csv.gz: gzip com nível configurável (anexos viram novos membros gzip);
+                # o buffer fica antes do compressor para o zlib receber blocos grandes
+                self.csv_sink = io.BufferedWriter(
+                    gzip.open(output_path, mode, compresslevel=OUTPUT_CONFIG['gzip_level']),
+                    buffer_size=OUTPUT_CONFIG['write_buffer_size']
+                )
+            else:
+                self.csv_sink = open(output_path, mode, buffering=OUTPUT_CONFIG['write_buffer_size'])
+            self.csv_sink_path = output_path
+        
+        pacsv.write_csv(table, self.csv_sink, write_options=write_options)
+    
+    def save_to_parquet_ultra(self, df: pd.DataFrame, output_path: str, append: bool = False):
+        """Salva DataFrame em Parquet (colunar, tipado e comprimido com zstd)"""
+        table = self.dataframe_to_arrow_ultra(df)
+        
+        if not append or self.parquet_writer is None:
+            self.close_parquet_writer()
+            # Colunas totalmente nulas no primeiro lote viram string no schema do arquivo
+            schema = pa.schema([
+                field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                for field in table.schema
+            ])
+            self.parquet_writer = pq.ParquetWriter(output_path, schema, compression='zstd')
+        
+        self.parquet_writer.write_table(table.cast(self.parquet_writer.schema))
+    
+    def close_csv_sink(self):
+        """Fecha o arquivo CSV em escrita, se houver"""
+        if self.csv_sink is not None:
+            self.csv_sink.close()
+            self.csv_sink = None
+            self.csv_sink_path = None
+    
+    def close_output_writers(self):
+        """Finaliza os arquivos de saída abertos (CSV e Parquet)"""
+        self.close_csv_sink()
+        self.close_parquet_writer()
+    
+    def close_parquet_writer(self):
+        """Finaliza o arquivo Parquet em escrita, se houver"""
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+    
+    def save_batch_ultra(self, df: pd.DataFrame, output_path: str, append: bool = False):
+        """Salva o lote no formato indicado pela extensão do arquivo (.parquet, .csv.gz ou CSV)"""
+        if Path(output_path).suffix.lower() == '.parquet':
+            self.save_to_parquet_ultra(df, output_path, append=append)
+        else:
+            self.save_to_csv_ultra(df, output_path, append=append)
+    
+    def save_batch_background(self, df: pd.DataFrame, output_path: str, append: bool = False):
+        """Agenda a escrita do lote na thread de escrita (mantém a ordem dos lotes)"""
+        # No máximo um lote pendente: limita a memória e propaga erros da escrita anterior
+        self.wait_pending_write()
+        if self.write_executor is None:
+            self.write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cnpj-writer')
+        self.pending_write = self.write_executor.submit(self.save_batch_ultra, df, output_path, append)
+    
+    def fetch_batch_background(self, limit: int, filters_dict: Dict[str, Any],
+                               last_cnpj: str) -> Future:
+        """Dispara a consulta do lote numa thread (conexão própria do pool)"""
+        if self.fetch_executor is None:
+            self.fetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cnpj-fetch')
+        query, params = self.build_ultra_optimized_query(
+            limit=limit,
+            filters_query=filters_dict,
+            last_cnpj=last_cnpj
+        )
+        return self.fetch_executor.submit(self.read_batch_ultra, query, params)
+    
+    def wait_pending_write(self):
+        """Aguarda a escrita em andamento, relançando exceções da thread de escrita"""
+        if self.pending_write is not None:
+            future, self.pending_write = self.pending_write, None
+            future.result()
     
     def run_ultra_optimized(self, limit: int = 0, output_path: str = None, filters_dict: Dict[str, Any] = None):
         """Executa processamento ULTRA otimizado para máxima performance"""
         try:
-            start_time = time.time()
+            start_time = time.perf_counter()
             
             self.connect_database()
             self.setup_ultra_optimization_settings()
             self.preload_lookup_caches()
+            self.socios_by_range = not filters_dict
             
-            # Obter total de registros (limitado a 200.000)
-            total_records = self.get_total_count_optimized(filters_dict)
+            # Sem COUNT(*) prévio: o streaming termina quando o cursor se esgota e a
+            # estimativa (limitada a 200.000) serve apenas para progresso/ETA
             max_limit = 200000
+            target_records = min(limit, max_limit) if limit > 0 else max_limit
+            total_records = min(self.estimate_total_count(), target_records)
             
-            logger.info("Total de registros a processar: %s", f"{total_records:,}")
+            logger.info("Total estimado de registros a processar: até %s", f"{total_records:,}")
             logger.info(
                 "📊 Limite global máximo: %s registros (ordenação otimizada)",
                 f"{max_limit:,}"
             )
             
-            if limit > 0:
-                total_records = min(total_records, limit)
-            
             # Preparar arquivo de saída
             if output_path is None:
                 output_path = os.path.join(
@@ -632,51 +1238,41 @@ class CNPJProcessorUltraOptimized:
             
             Path(output_path).parent.mkdir(parents=True, exist_ok=True)
             
-            # Processar em lotes ULTRA otimizados
+            # Uma única consulta em streaming: lotes lidos via fetchmany do cursor server-side
             processed = 0
             batch_num = 1
             
+            query, params = self.build_ultra_optimized_query(
+                limit=target_records,
+                filters_query=filters_dict
+            )
+            
             logger.info("Iniciando processamento ULTRA em lotes de %s registros...", f"{self.batch_size:,}")
             
-            while processed < total_records:
-                batch_start = time.time()
-                
-                # Calcular offset e limite do lote
-                current_batch_size = min(self.batch_size, total_records - processed)
-                
-                # Executar consulta ULTRA otimizada
-                query = self.build_ultra_optimized_query(
-                    limit=current_batch_size,
-                    offset=processed,
-                    filters_query=filters_dict
-                )
-                
-                # Executar com SQLAlchemy otimizada
-                df_batch = pd.read_sql(query, self.engine)
-                
+            batch_start = time.perf_counter()
+            for df_batch in self.iter_batches_ultra(query, params, self.batch_size):
                 if df_batch.empty:
-                    logger.warning("Lote vazio retornado, interrompendo processamento")
                     break
                 
                 # Processar lote ULTRA otimizado
-                df_processed = self.process_batch_ultra_optimized(df_batch)
+                df_processed = self.process_batch_ultra_optimized(df_batch, start_id=processed + 1)
                 
                 # Salvar lote
                 append_mode = batch_num > 1
-                self.save_to_csv_ultra(df_processed, output_path, append=append_mode)
+                self.save_batch_background(df_processed, output_path, append=append_mode)
                 
                 processed += len(df_processed)
-                batch_time = time.time() - batch_start
+                batch_time = time.perf_counter() - batch_start
                 
                 # Calcular métricas de performance
                 records_per_second = len(df_processed) / batch_time if batch_time > 0 else 0
-                total_time = time.time() - start_time
+                total_time = time.perf_counter() - start_time
                 avg_speed = processed / total_time if total_time > 0 else 0
-                eta_seconds = (total_records - processed) / avg_speed if avg_speed > 0 else 0
+                eta_seconds = max(total_records - processed, 0) / avg_speed if avg_speed > 0 else 0
                 eta_minutes = eta_seconds / 60
                 
                 logger.info(
-                    "Lote %s: %s registros processados (%s/%s) - "
+                    "Lote %s: %s registros processados (%s/~%s) - "
                     "Tempo: %.2fs - Velocidade: %.0f reg/s - "
                     "Média: %.0f reg/s - ETA: %.1f min",
                     batch_num,
@@ -690,8 +1286,13 @@ class CNPJProcessorUltraOptimized:
                 )
                 
                 batch_num += 1
+                batch_start = time.perf_counter()
             
-            total_time = time.time() - start_time
+            # Aguardar a última escrita e finalizar o arquivo de saída
+            self.wait_pending_write()
+            self.close_output_writers()
+            
+            total_time = time.perf_counter() - start_time
             final_speed = processed / total_time if total_time > 0 else 0
             
             logger.info(
@@ -715,7 +1316,7 @@ class CNPJProcessorUltraOptimized:
                                       output_path: str = None, filters_dict: Dict[str, Any] = None):
         """Executa processamento ULTRA otimizado com offset específico"""
         try:
-            start_time = time.time()
+            start_time = time.perf_counter()
             
             # Preparar arquivo de saída
             if output_path is None:
@@ -724,37 +1325,38 @@ class CNPJProcessorUltraOptimized:
                 )
             
             Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+            self.socios_by_range = not filters_dict
             
             # Processar em lotes ULTRA otimizados com cursor-based pagination
             processed = 0
             batch_num = 1
-            last_cnpj = None
+            
+            # Continuar do último CNPJ da parte anterior; sem ele, localizar o início pelo offset
+            if offset > 0 and self.last_cnpj is not None:
+                last_cnpj = self.last_cnpj
+            else:
+                last_cnpj = self.find_cnpj_before_offset(offset, filters_dict)
+            
+            # Consulta do próximo lote em andamento (prefetch) enquanto o atual é processado
+            self.next_fetch = None
+            current_batch_size = min(self.batch_size, limit)
             
             while processed < limit:
-                batch_start = time.time()
-                
-                # Calcular limite do lote
-                current_batch_size = min(self.batch_size, limit - processed)
+                batch_start = time.perf_counter()
                 
                 logger.info("🔄 Iniciando lote %s: cursor=%s, size=%s", 
                            batch_num, last_cnpj or "início", f"{current_batch_size:,}")
                 
                 try:
-                    # Executar consulta ULTRA otimizada com cursor
-                    query = self.build_ultra_optimized_query(
-                        limit=current_batch_size,
-                        offset=0,  # Não usar offset
-                        filters_query=filters_dict,
-                        last_cnpj=last_cnpj
-                    )
-                    
-                    logger.debug("Executando consulta SQL...")
-                    query_start = time.time()
+                    logger.debug("Aguardando consulta SQL...")
+                    query_start = time.perf_counter()
                     
-                    # Executar com SQLAlchemy otimizada
-                    df_batch = pd.read_sql(query, self.engine)
+                    if self.next_fetch is None:
+                        self.next_fetch = self.fetch_batch_background(current_batch_size, filters_dict, last_cnpj)
+                    df_batch = self.next_fetch.result()
+                    self.next_fetch = None
                     
-                    query_time = time.time() - query_start
+                    query_time = time.perf_counter() - query_start
                     logger.debug("Consulta SQL concluída em %.2fs, retornou %s registros", 
                                query_time, len(df_batch))
                     
@@ -762,25 +1364,34 @@ class CNPJProcessorUltraOptimized:
                         logger.warning("Lote vazio retornado, interrompendo processamento")
                         break
                     
+                    # Capturar o último CNPJ e já disparar a consulta do próximo lote
+                    last_cnpj = df_batch['cnpj'].iloc[-1]
+                    self.last_cnpj = last_cnpj
+                    logger.debug("Último CNPJ do lote: %s", last_cnpj)
+                    
+                    remaining = limit - processed - len(df_batch)
+                    requested_size = current_batch_size
+                    if remaining > 0 and len(df_batch) == requested_size:
+                        current_batch_size = min(self.batch_size, remaining)
+                        self.next_fetch = self.fetch_batch_background(current_batch_size, filters_dict, last_cnpj)
+                    
                     # Processar lote ULTRA otimizado
                     logger.debug("Processando lote...")
-                    process_start = time.time()
-                    df_processed = self.process_batch_ultra_optimized(df_batch)
-                    process_time = time.time() - process_start
+                    process_start = time.perf_counter()
+                    # IDs contínuos entre as partes: o offset é o total gravado nas partes anteriores
+                    df_processed = self.process_batch_ultra_optimized(
+                        df_batch, start_id=offset + processed + 1
+                    )
+                    process_time = time.perf_counter() - process_start
                     logger.debug("Processamento concluído em %.2fs", process_time)
                     
                     # Salvar lote
-                    logger.debug("Salvando lote...")
-                    save_start = time.time()
+                    logger.debug("Agendando escrita do lote...")
+                    save_start = time.perf_counter()
                     append_mode = batch_num > 1
-                    self.save_to_csv_ultra(df_processed, output_path, append=append_mode)
-                    save_time = time.time() - save_start
-                    logger.debug("Salvamento concluído em %.2fs", save_time)
-                    
-                    # Capturar o último CNPJ para cursor-based pagination
-                    if not df_processed.empty:
-                        last_cnpj = df_processed['cnpj'].iloc[-1]
-                        logger.debug("Último CNPJ do lote: %s", last_cnpj)
+                    self.save_batch_background(df_processed, output_path, append=append_mode)
+                    save_time = time.perf_counter() - save_start
+                    logger.debug("Escrita agendada em %.2fs (inclui espera do lote anterior)", save_time)
                     
                 except Exception as e:
                     logger.error("❌ Erro no lote %s: %s", batch_num, e)
@@ -788,14 +1399,14 @@ class CNPJProcessorUltraOptimized:
                     raise
                 
                 processed += len(df_processed)
-                batch_time = time.time() - batch_start
+                batch_time = time.perf_counter() - batch_start
                 
                 # Ajustar tamanho do lote baseado na performance
-                self.batch_size = self.adjust_batch_size(batch_time, self.batch_size)
+                self.batch_size = self.adjust_batch_size(batch_time, self.batch_size, len(df_processed))
                 
                 # Calcular métricas de performance
                 records_per_second = len(df_processed) / batch_time if batch_time > 0 else 0
-                total_time = time.time() - start_time
+                total_time = time.perf_counter() - start_time
                 avg_speed = processed / total_time if total_time > 0 else 0
                 eta_seconds = (limit - processed) / avg_speed if avg_speed > 0 else 0
                 eta_minutes = eta_seconds / 60
@@ -816,13 +1427,21 @@ class CNPJProcessorUltraOptimized:
                     f"{self.batch_size:,}"
                 )
                 
+                # Lote incompleto: não há mais registros para este filtro
+                if len(df_batch) < requested_size:
+                    break
+                
                 # Liberar recursos mínimos após cada lote (apenas a cada 5 lotes)
                 if batch_num % 5 == 0:
                     self.cleanup_resources_after_batch()
                 
                 batch_num += 1
             
-            total_time = time.time() - start_time
+            # Aguardar a última escrita e finalizar o arquivo de saída
+            self.wait_pending_write()
+            self.close_output_writers()
+            
+            total_time = time.perf_counter() - start_time
             final_speed = processed / total_time if total_time > 0 else 0
             
             logger.info(
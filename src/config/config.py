@@ -26,7 +26,9 @@ OUTPUT_CONFIG = {
     'output_dir': os.path.join(project_root, 'output'),
     'csv_separator': ';',
     'csv_encoding': 'utf-8',
-    'csv_quoting': 'all'
+    'csv_quoting': 'minimal',  # 'minimal' (aspas só em textos) ou 'all'
+    'write_buffer_size': 16 * 1024 * 1024,  # Buffer de escrita (16MB) para reduzir syscalls
+    'gzip_level': 1  # Nível de compressão das saídas .csv.gz (1 = mais rápido, 9 = menor arquivo)
 }
 
 # Configurações de Desenvolvimento
@@ -4,9 +4,12 @@ Sistema de Filtros Interativos para CNPJ
 """
 
 import re
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 
+# Data YYYYMMDD com mês 01-12 e dia 01-31 (ano 0000 não existe)
+DATA_PATTERN = re.compile(r'^(?!0000)\d{4}(0[1-9]|1[0-2])(0[1-9]|[12]\d|3[01])$')
+
 class CNPJFilters:
     """Classe para gerenciar filtros interativos do sistema CNPJ"""
     
@@ -39,16 +42,17 @@ class CNPJFilters:
         print("Digite a sigla da UF (ex: SP, RJ, MG)")
         print("Ou pressione Enter para pular este filtro")
         
-        uf = input("UF: ").strip().upper()
-        
-        if uf and len(uf) == 2:
-            print(f"✅ Filtro UF aplicado: {uf}")
-            return uf
-        elif uf:
-            print("❌ UF inválida. Use sigla de 2 letras (ex: SP)")
-            return self.get_uf()
-        
-        return None
+        while True:
+            uf = input("UF: ").strip().upper()
+            
+            if uf and len(uf) == 2:
+                print(f"✅ Filtro UF aplicado: {uf}")
+                return uf
+            elif uf:
+                print("❌ UF inválida. Use sigla de 2 letras (ex: SP)")
+                continue
+            
+            return None
     
     def get_codigo_municipio(self) -> Optional[str]:
         """Solicita código do município do usuário"""
@@ -56,16 +60,17 @@ class CNPJFilters:
         print("Digite o código do município (ex: 9733)")
         print("Ou pressione Enter para pular este filtro")
         
-        codigo = input("Código do município: ").strip()
-        
-        if codigo and codigo.isdigit():
-            print(f"✅ Filtro município aplicado: {codigo}")
-            return codigo
-        elif codigo:
-            print("❌ Código inválido. Use apenas números")
-            return self.get_codigo_municipio()
-        
-        return None
+        while True:
+            codigo = input("Código do município: ").strip()
+            
+            if codigo and codigo.isdigit():
+                print(f"✅ Filtro município aplicado: {codigo}")
+                return codigo
+            elif codigo:
+                print("❌ Código inválido. Use apenas números")
+                continue
+            
+            return None
     
     def get_situacao_cadastral(self) -> Optional[str]:
         """Solicita situação cadastral do usuário"""
@@ -75,22 +80,12 @@ class CNPJFilters:
         print("3 - Inativos (situações = 1, 3, 8)")
         print("Ou pressione Enter para usar o padrão (Ativos)")
         
-        opcao = input("Situação cadastral: ").strip()
-        
-        if opcao == '1' or opcao == '':
-            print("✅ Filtro aplicado: Apenas empresas ATIVAS")
-            return 'ativos'
-        elif opcao == '2':
-            print("✅ Filtro aplicado: Apenas empresas INAPTAS")
-            return 'inaptos'
-        elif opcao == '3':
-            print("✅ Filtro aplicado: Apenas empresas INATIVAS")
-            return 'inativos'
-        else:
-            print("❌ Opção inválida. Use 1, 2 ou 3")
-            return self.get_situacao_cadastral()
-        
-        return None
+        return self._prompt_choice("Situação cadastral: ", {
+            '1': ('ativos', "Apenas empresas ATIVAS"),
+            '': ('ativos', "Apenas empresas ATIVAS"),
+            '2': ('inaptos', "Apenas empresas INAPTAS"),
+            '3': ('inativos', "Apenas empresas INATIVAS"),
+        }, "Use 1, 2 ou 3")
     
     def get_data_inicio_atividade(self) -> Optional[Dict[str, str]]:
         """Solicita intervalo de data de início de atividade"""
@@ -98,24 +93,27 @@ class CNPJFilters:
         print("Formato: YYYYMMDD (ex: 20200101)")
         print("Ou pressione Enter para pular este filtro")
         
-        data_inicio = input("Data início (desde): ").strip()
-        data_fim = input("Data fim (até): ").strip()
-        
-        if not data_inicio and not data_fim:
-            return None
-        
-        # Validar formato das datas
-        if data_inicio and not self._validar_data(data_inicio):
-            print("❌ Data início inválida. Use formato YYYYMMDD")
-            return self.get_data_inicio_atividade()
-        
-        if data_fim and not self._validar_data(data_fim):
-            print("❌ Data fim inválida. Use formato YYYYMMDD")
-            return self.get_data_inicio_atividade()
-        
-        if data_inicio and data_fim and data_inicio > data_fim:
-            print("❌ Data início deve ser anterior à data fim")
-            return self.get_data_inicio_atividade()
+        while True:
+            data_inicio = input("Data início (desde): ").strip()
+            data_fim = input("Data fim (até): ").strip()
+            
+            if not data_inicio and not data_fim:
+                return None
+            
+            # Validar formato das datas
+            if data_inicio and not self._validar_data(data_inicio):
+                print("❌ Data início inválida. Use formato YYYYMMDD")
+                continue
+            
+            if data_fim and not self._validar_data(data_fim):
+                print("❌ Data fim inválida. Use formato YYYYMMDD")
+                continue
+            
+            if data_inicio and data_fim and data_inicio > data_fim:
+                print("❌ Data início deve ser anterior à data fim")
+                continue
+            
+            break
         
         filtro = {}
         if data_inicio:
@@ -133,19 +131,10 @@ class CNPJFilters:
         print("n - Apenas registros SEM email")
         print("Ou pressione Enter para pular este filtro")
         
-        opcao = input("Com email (s/n): ").strip().lower()
-        
-        if opcao == 's':
-            print("✅ Filtro aplicado: Apenas registros COM email")
-            return True
-        elif opcao == 'n':
-            print("✅ Filtro aplicado: Apenas registros SEM email")
-            return False
-        elif opcao:
-            print("❌ Opção inválida. Use 's' ou 'n'")
-            return self.get_com_email()
-        
-        return None
+        return self._prompt_choice("Com email (s/n): ", {
+            's': (True, "Apenas registros COM email"),
+            'n': (False, "Apenas registros SEM email"),
+        }, "Use 's' ou 'n'")
     
     def get_com_telefone(self) -> Optional[bool]:
         """Solicita se deve filtrar por registros com telefone"""
@@ -154,19 +143,10 @@ class CNPJFilters:
         print("n - Apenas registros SEM telefone")
         print("Ou pressione Enter para pular este filtro")
         
-        opcao = input("Com telefone (s/n): ").strip().lower()
-        
-        if opcao == 's':
-            print("✅ Filtro aplicado: Apenas registros COM telefone")
-            return True
-        elif opcao == 'n':
-            print("✅ Filtro aplicado: Apenas registros SEM telefone")
-            return False
-        elif opcao:
-            print("❌ Opção inválida. Use 's' ou 'n'")
-            return self.get_com_telefone()
-        
-        return None
+        return self._prompt_choice("Com telefone (s/n): ", {
+            's': (True, "Apenas registros COM telefone"),
+            'n': (False, "Apenas registros SEM telefone"),
+        }, "Use 's' ou 'n'")
     
     def get_tipo_telefone(self) -> Optional[str]:
         """Solicita tipo de telefone"""
@@ -176,22 +156,11 @@ class CNPJFilters:
         print("3 - Ambos (fixos e celulares)")
         print("Ou pressione Enter para pular este filtro")
         
-        opcao = input("Tipo de telefone: ").strip()
-        
-        if opcao == '1':
-            print("✅ Filtro aplicado: Apenas telefones fixos")
-            return 'fixo'
-        elif opcao == '2':
-            print("✅ Filtro aplicado: Apenas celulares")
-            return 'celular'
-        elif opcao == '3':
-            print("✅ Filtro aplicado: Ambos os tipos")
-            return 'ambos'
-        elif opcao:
-            print("❌ Opção inválida. Use 1, 2 ou 3")
-            return self.get_tipo_telefone()
-        
-        return None
+        return self._prompt_choice("Tipo de telefone: ", {
+            '1': ('fixo', "Apenas telefones fixos"),
+            '2': ('celular', "Apenas celulares"),
+            '3': ('ambos', "Ambos os tipos"),
+        }, "Use 1, 2 ou 3")
     
     def get_opcao_tributaria(self) -> Optional[str]:
         """Solicita opção tributária"""
@@ -201,22 +170,11 @@ class CNPJFilters:
         print("3 - Todas")
         print("Ou pressione Enter para pular este filtro")
         
-        opcao = input("Opção tributária: ").strip()
-        
-        if opcao == '1':
-            print("✅ Filtro aplicado: Apenas MEI")
-            return 'mei'
-        elif opcao == '2':
-            print("✅ Filtro aplicado: Sem MEI")
-            return 'sem_mei'
-        elif opcao == '3':
-            print("✅ Filtro aplicado: Todas as opções")
-            return 'todas'
-        elif opcao:
-            print("❌ Opção inválida. Use 1, 2 ou 3")
-            return self.get_opcao_tributaria()
-        
-        return None
+        return self._prompt_choice("Opção tributária: ", {
+            '1': ('mei', "Apenas MEI"),
+            '2': ('sem_mei', "Sem MEI"),
+            '3': ('todas', "Todas as opções"),
+        }, "Use 1, 2 ou 3")
     
     def get_capital_social(self) -> Optional[str]:
         """Solicita faixa de capital social"""
@@ -227,31 +185,42 @@ class CNPJFilters:
         print("4 - Qualquer valor")
         print("Ou pressione Enter para pular este filtro")
         
-        opcao = input("Faixa de capital: ").strip()
-        
-        if opcao == '1':
-            print("✅ Filtro aplicado: Capital > R$ 10.000")
-            return '10k'
-        elif opcao == '2':
-            print("✅ Filtro aplicado: Capital > R$ 50.000")
-            return '50k'
-        elif opcao == '3':
-            print("✅ Filtro aplicado: Capital > R$ 100.000")
-            return '100k'
-        elif opcao == '4':
-            print("✅ Filtro aplicado: Qualquer capital")
-            return 'qualquer'
-        elif opcao:
-            print("❌ Opção inválida. Use 1, 2, 3 ou 4")
-            return self.get_capital_social()
-        
-        return None
+        return self._prompt_choice("Faixa de capital: ", {
+            '1': ('10k', "Capital > R$ 10.000"),
+            '2': ('50k', "Capital > R$ 50.000"),
+            '3': ('100k', "Capital > R$ 100.000"),
+            '4': ('qualquer', "Qualquer capital"),
+        }, "Use 1, 2, 3 ou 4")
+    
+    def _prompt_choice(self, label: str, opcoes: Dict[str, Tuple[Any, str]], ajuda: str) -> Any:
+        """
+        Lê uma opção do usuário e devolve o valor associado a ela
+        
+        opcoes mapeia a resposta digitada para (valor, descrição do filtro).
+        Resposta vazia sem entrada em opcoes pula o filtro (None); resposta
+        inválida é perguntada de novo.
+        """
+        while True:
+            opcao = input(label).strip().lower()
+            
+            if opcao in opcoes:
+                valor, descricao = opcoes[opcao]
+                print(f"✅ Filtro aplicado: {descricao}")
+                return valor
+            if not opcao:
+                return None
+            
+            print(f"❌ Opção inválida. {ajuda}")
     
     def _validar_data(self, data: str) -> bool:
         """Valida formato de data YYYYMMDD"""
-        if len(data) != 8 or not data.isdigit():
+        if len(data) != 8 or not DATA_PATTERN.match(data):
             return False
         
+        # Dias 01-28 existem em todos os meses; só 29-31 dependem do mês/ano bissexto
+        if data[6:] <= '28':
+            return True
+        
         try:
             datetime.strptime(data, '%Y%m%d')
             return True
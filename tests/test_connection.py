@@ -8,8 +8,15 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from src.cnpj_processor import CNPJProcessor
 import logging
+import pytest
+
+# Processador padrão (cnpj_processor.py) é opcional no pacote: sem ele o teste é
+# pulado explicitamente em vez de falhar na coleta ou passar sem testar nada
+CNPJProcessor = pytest.importorskip(
+    "src.cnpj_processor.cnpj_processor",
+    reason="src/cnpj_processor/cnpj_processor.py (CNPJProcessor) não está instalado",
+).CNPJProcessor
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,20 +24,21 @@ logger = logging.getLogger(__name__)
 
 def test_connection():
     """Testa a conexão com o banco MySQL"""
+    processor = CNPJProcessor()
+    processor.connect_database()
     try:
-        processor = CNPJProcessor()
-        processor.connect_database()
-        
         # Testa uma consulta simples
         cursor = processor.connection.cursor()
         cursor.execute("SELECT COUNT(*) as total FROM cnpj_empresas")
         result = cursor.fetchone()
-        logger.info(f"Total de empresas no banco: {result[0]}")
+        assert result is not None
+        logger.info("Total de empresas no banco: %s", result[0])
         
         # Testa consulta em estabelecimentos
         cursor.execute("SELECT COUNT(*) as total FROM cnpj_estabelecimentos")
         result = cursor.fetchone()
-        logger.info(f"Total de estabelecimentos no banco: {result[0]}")
+        assert result is not None
+        logger.info("Total de estabelecimentos no banco: %s", result[0])
         
         # Testa JOIN básico
         cursor.execute("""
@@ -40,15 +48,16 @@ def test_connection():
             LIMIT 1
         """)
         result = cursor.fetchone()
-        logger.info(f"Teste de JOIN executado com sucesso: {result[0]} registros")
-        
+        assert result is not None
+        logger.info("Teste de JOIN executado com sucesso: %s registros", result[0])
+    finally:
         processor.close_database()
-        logger.info("✅ Conexão com MySQL funcionando perfeitamente!")
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Erro na conexão: {e}")
-        return False
+    
+    logger.info("✅ Conexão com MySQL funcionando perfeitamente!")
 
 if __name__ == "__main__":
-    test_connection()
+    try:
+        test_connection()
+    except Exception as e:
+        logger.error("❌ Erro na conexão: %s", e)
+        sys.exit(1)
@@ -6,193 +6,227 @@ Testa consulta completa usando o filtro exemplo_basico e gera CSV
 
 import sys
 import os
+import copy
 import json
+import traceback
 from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from src.cnpj_processor import CNPJProcessor
 import logging
+import pandas as pd
+import pytest
+
+# Processador padrão (cnpj_processor.py) é opcional no pacote: sem ele os testes são
+# pulados explicitamente em vez de falhar na coleta ou passar sem testar nada
+CNPJProcessor = pytest.importorskip(
+    "src.cnpj_processor.cnpj_processor",
+    reason="src/cnpj_processor/cnpj_processor.py (CNPJProcessor) não está instalado",
+).CNPJProcessor
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Timestamp da execução, usado em todos os arquivos gerados por ela
+RUN_TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+# Pasta dos arquivos gerados pelos testes
+OUTPUT_DIR = Path("output")
+
+@lru_cache(maxsize=1)
+def _read_example_filters():
+    """Lê o arquivo JSON de filtros (exceções não ficam em cache: a próxima chamada relê)"""
+    with open('examples/exemplos_filtros.json', 'r', encoding='utf-8') as f:
+        return json.load(f)
+
 def load_example_filters():
-    """Carrega os filtros de exemplo do arquivo JSON"""
+    """Carrega os filtros de exemplo (arquivo lido uma vez por processo, cópia por chamada)"""
     try:
-        with open('examples/exemplos_filtros.json', 'r', encoding='utf-8') as f:
-            examples = json.load(f)
-        return examples
+        return copy.deepcopy(_read_example_filters())
     except Exception as e:
-        logger.error(f"Erro ao carregar exemplos de filtros: {e}")
+        logger.error("Erro ao carregar exemplos de filtros: %s", e)
         return None
 
-def test_exemplo_basico_complete():
-    """Teste completo usando o filtro exemplo_basico"""
+def connect_or_skip():
+    """Processador conectado; sem banco acessível o teste é pulado (não conta como aprovado)"""
+    processor = CNPJProcessor()
     try:
-        # Carrega filtros de exemplo
-        examples = load_example_filters()
-        if not examples:
-            logger.error("❌ Não foi possível carregar os exemplos de filtros")
-            return False
-        
-        # Usa o filtro exemplo_basico
-        filtro_exemplo = examples['exemplo_basico']
-        
-        logger.info("🚀 Iniciando teste completo com exemplo_basico")
-        logger.info("=" * 70)
-        logger.info(f"📋 Filtro exemplo_basico:")
-        for chave, valor in filtro_exemplo.items():
-            logger.info(f"   {chave}: {valor}")
-        logger.info("=" * 70)
-        
-        # Inicializa o processador
-        processor = CNPJProcessor()
         processor.connect_database()
-        
+    except Exception as e:
+        pytest.skip(f"Banco de dados indisponível: {e}")
+    return processor
+
+def test_exemplo_basico_complete(processor=None):
+    """
+    Teste completo usando o filtro exemplo_basico
+    
+    processor: processador já conectado (compartilhado entre os testes);
+    sem ele o teste abre e fecha a própria conexão
+    """
+    own_processor = processor is None
+    # Carrega filtros de exemplo
+    examples = load_example_filters()
+    assert examples, "Não foi possível carregar os exemplos de filtros"
+    
+    # Usa o filtro exemplo_basico
+    filtro_exemplo = examples['exemplo_basico']
+    
+    logger.info("🚀 Iniciando teste completo com exemplo_basico")
+    logger.info("=" * 70)
+    logger.info("📋 Filtro exemplo_basico:")
+    for chave, valor in filtro_exemplo.items():
+        logger.info("   %s: %s", chave, valor)
+    logger.info("=" * 70)
+    
+    # Inicializa o processador (apenas se não foi recebido já conectado)
+    if own_processor:
+        processor = connect_or_skip()
+    
+    try:
         # Executa processamento completo com limite maior para ter dados suficientes
         logger.info("🔍 Executando consulta com filtros...")
         df = processor.process_data(limit=100, filters=filtro_exemplo)
         
         # Validações e análises
-        logger.info(f"✅ Consulta executada com sucesso!")
-        logger.info(f"📊 Total de registros encontrados: {len(df)}")
+        logger.info("✅ Consulta executada com sucesso!")
+        logger.info("📊 Total de registros encontrados: %s", len(df))
         
         if len(df) > 0:
-            # Análise dos dados retornados
-            logger.info("\n📈 ANÁLISE DOS DADOS:")
-            
-            # Verifica UF
-            uf_unicas = df['uf'].unique()
-            logger.info(f"   🌍 UFs encontradas: {uf_unicas}")
-            
-            # Verifica municípios
-            municipios = df['municipio'].unique()
-            logger.info(f"   🏙️ Municípios encontrados: {len(municipios)}")
-            if len(municipios) <= 5:
-                logger.info(f"      {municipios}")
-            
-            # Verifica situações cadastrais
-            situacoes = df['situacao_cadastral'].unique()
-            logger.info(f"   📊 Situações cadastrais: {situacoes}")
-            
-            # Verifica códigos de município
-            codigos_municipio = df['codigo_municipio'].unique()
-            logger.info(f"   🏷️ Códigos de município: {codigos_municipio}")
-            
-            # Mostra alguns exemplos de registros
-            logger.info(f"\n📋 EXEMPLOS DE REGISTROS ENCONTRADOS:")
-            for i, row in df.head(5).iterrows():
-                logger.info(f"   {i+1}. CNPJ: {row['cnpj']}")
-                logger.info(f"      Razão Social: {row['razao_social']}")
-                logger.info(f"      Município: {row['municipio']} ({row['codigo_municipio']})")
-                logger.info(f"      UF: {row['uf']}")
-                logger.info(f"      Situação: {row['situacao_cadastral']}")
-                if row['nome_fantasia']:
-                    logger.info(f"      Nome Fantasia: {row['nome_fantasia']}")
-                logger.info(f"      ---")
-            
-            # Gera CSV com timestamp para identificação única
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_filename = f"exemplo_basico_BA_municipio3455_{timestamp}.csv"
-            output_path = f"output/{output_filename}"
-            
-            logger.info(f"\n💾 Gerando arquivo CSV...")
+            # Diagnóstico só é calculado quando o nível INFO está ativo
+            if logger.isEnabledFor(logging.INFO):
+                # Análise dos dados retornados
+                logger.info("\n📈 ANÁLISE DOS DADOS:")
+                
+                # Verifica UF
+                uf_unicas = df['uf'].unique()
+                logger.info("   🌍 UFs encontradas: %s", uf_unicas)
+                
+                # Verifica municípios
+                municipios = df['municipio'].unique()
+                logger.info("   🏙️ Municípios encontrados: %s", len(municipios))
+                if len(municipios) <= 5:
+                    logger.info("      %s", municipios)
+                
+                # Verifica situações cadastrais
+                situacoes = df['situacao_cadastral'].unique()
+                logger.info("   📊 Situações cadastrais: %s", situacoes)
+                
+                # Verifica códigos de município
+                codigos_municipio = df['codigo_municipio'].unique()
+                logger.info("   🏷️ Códigos de município: %s", codigos_municipio)
+                
+                # Mostra alguns exemplos de registros
+                logger.info("\n📋 EXEMPLOS DE REGISTROS ENCONTRADOS:")
+                colunas_exemplo = ['cnpj', 'razao_social', 'municipio', 'codigo_municipio',
+                                   'uf', 'situacao_cadastral', 'nome_fantasia']
+                logger.info("\n%s", df.head(5)[colunas_exemplo].to_string(index=False))
+            
+            # Gera CSV com timestamp da execução para identificação única
+            output_filename = f"exemplo_basico_BA_municipio3455_{RUN_TIMESTAMP}.csv"
+            OUTPUT_DIR.mkdir(exist_ok=True)
+            output_path = str(OUTPUT_DIR / output_filename)
+            
+            logger.info("\n💾 Gerando arquivo CSV...")
             processor.save_to_csv(df, output_path)
             
             # Validação do arquivo gerado
-            import pandas as pd
             df_verificacao = pd.read_csv(output_path, sep=';')
-            logger.info(f"✅ CSV gerado com sucesso!")
-            logger.info(f"📁 Arquivo: {output_path}")
-            logger.info(f"📊 Registros no CSV: {len(df_verificacao)}")
-            logger.info(f"📋 Colunas no CSV: {len(df_verificacao.columns)}")
+            logger.info("✅ CSV gerado com sucesso!")
+            logger.info("📁 Arquivo: %s", output_path)
+            logger.info("📊 Registros no CSV: %s", len(df_verificacao))
+            logger.info("📋 Colunas no CSV: %s", len(df_verificacao.columns))
             
             # Mostra algumas colunas importantes
             colunas_importantes = ['cnpj', 'razao_social', 'nome_fantasia', 'uf', 'municipio', 'situacao_cadastral']
             colunas_presentes = [col for col in colunas_importantes if col in df_verificacao.columns]
-            logger.info(f"🔍 Colunas importantes presentes: {colunas_presentes}")
+            logger.info("🔍 Colunas importantes presentes: %s", colunas_presentes)
             
             # Verifica se o filtro foi aplicado corretamente
-            logger.info(f"\n🔍 VALIDAÇÃO DOS FILTROS:")
+            logger.info("\n🔍 VALIDAÇÃO DOS FILTROS:")
             
             # Valida UF = BA
             uf_correta = df_verificacao['uf'].isin(['BA']).all()
-            logger.info(f"   ✅ UF = BA: {'SIM' if uf_correta else 'NÃO'}")
+            logger.info("   ✅ UF = BA: %s", 'SIM' if uf_correta else 'NÃO')
             
             # Valida código município = 3455
             municipio_correto = df_verificacao['codigo_municipio'].isin([3455]).all()
-            logger.info(f"   ✅ Código Município = 3455: {'SIM' if municipio_correto else 'NÃO'}")
+            logger.info("   ✅ Código Município = 3455: %s", 'SIM' if municipio_correto else 'NÃO')
             
             # Valida situação cadastral = ativos (2)
             situacao_correta = df_verificacao['situacao_cadastral'].isin([2]).all()
-            logger.info(f"   ✅ Situação = Ativos (2): {'SIM' if situacao_correta else 'NÃO'}")
+            logger.info("   ✅ Situação = Ativos (2): %s", 'SIM' if situacao_correta else 'NÃO')
             
-            if uf_correta and municipio_correto and situacao_correta:
-                logger.info("🎉 Todos os filtros foram aplicados corretamente!")
-            else:
-                logger.warning("⚠️ Alguns filtros podem não ter sido aplicados corretamente")
+            assert uf_correta and municipio_correto and situacao_correta, \
+                "Alguns filtros não foram aplicados corretamente"
+            logger.info("🎉 Todos os filtros foram aplicados corretamente!")
             
         else:
             logger.warning("⚠️ Nenhum registro encontrado com o filtro exemplo_basico")
             logger.info("💡 Dica: Verifique se existem empresas ativas em BA, município 3455")
-        
-        processor.close_database()
-        logger.info("\n✅ Teste completo do exemplo_basico concluído!")
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Erro no teste completo: {e}")
-        import traceback
-        logger.error(f"Detalhes do erro: {traceback.format_exc()}")
-        return False
+    finally:
+        if own_processor:
+            processor.close_database()
+    
+    logger.info("\n✅ Teste completo do exemplo_basico concluído!")
 
-def test_comparison_without_filters():
-    """Teste comparativo sem filtros"""
+def test_comparison_without_filters(processor=None):
+    """Teste comparativo sem filtros (processor: mesmo uso de test_exemplo_basico_complete)"""
+    own_processor = processor is None
+    logger.info("\n🔍 TESTE COMPARATIVO - Sem filtros:")
+    logger.info("-" * 50)
+    
+    if own_processor:
+        processor = connect_or_skip()
+    
     try:
-        logger.info("\n🔍 TESTE COMPARATIVO - Sem filtros:")
-        logger.info("-" * 50)
-        
-        processor = CNPJProcessor()
-        processor.connect_database()
-        
         # Consulta sem filtros para comparação
         df_sem_filtro = processor.process_data(limit=50, filters=None)
         
-        logger.info(f"📊 Registros sem filtros: {len(df_sem_filtro)}")
+        logger.info("📊 Registros sem filtros: %s", len(df_sem_filtro))
         
         if len(df_sem_filtro) > 0:
-            uf_sem_filtro = df_sem_filtro['uf'].value_counts().head()
-            logger.info(f"🌍 Top 5 UFs sem filtro:")
-            for uf, count in uf_sem_filtro.items():
-                logger.info(f"   {uf}: {count} registros")
-            
-            situacoes_sem_filtro = df_sem_filtro['situacao_cadastral'].value_counts()
-            logger.info(f"📊 Situações sem filtro:")
-            for situacao, count in situacoes_sem_filtro.items():
-                logger.info(f"   {situacao}: {count} registros")
-        
-        processor.close_database()
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Erro no teste comparativo: {e}")
-        return False
+            # Contagens só são calculadas quando o nível INFO está ativo
+            if logger.isEnabledFor(logging.INFO):
+                uf_sem_filtro = df_sem_filtro['uf'].value_counts().head()
+                logger.info("🌍 Top 5 UFs sem filtro:")
+                for uf, count in uf_sem_filtro.items():
+                    logger.info("   %s: %s registros", uf, count)
+                
+                situacoes_sem_filtro = df_sem_filtro['situacao_cadastral'].value_counts()
+                logger.info("📊 Situações sem filtro:")
+                for situacao, count in situacoes_sem_filtro.items():
+                    logger.info("   %s: %s registros", situacao, count)
+    finally:
+        if own_processor:
+            processor.close_database()
 
 if __name__ == "__main__":
     logger.info("🚀 INICIANDO TESTE COMPLETO - EXEMPLO BÁSICO")
     logger.info("=" * 70)
     
-    # Executa teste principal
-    sucesso_principal = test_exemplo_basico_complete()
-    
-    # Executa teste comparativo
-    sucesso_comparativo = test_comparison_without_filters()
+    # Uma única conexão para os dois testes
+    processor = CNPJProcessor()
+    processor.connect_database()
+    falhas = []
+    try:
+        # Executa teste principal e teste comparativo
+        for teste in (test_exemplo_basico_complete, test_comparison_without_filters):
+            try:
+                teste(processor)
+            except Exception as e:
+                logger.error("❌ Erro em %s: %s", teste.__name__, e)
+                logger.error("Detalhes do erro: %s", traceback.format_exc())
+                falhas.append(teste.__name__)
+    finally:
+        processor.close_database()
     
     logger.info("=" * 70)
-    if sucesso_principal and sucesso_comparativo:
+    if not falhas:
         logger.info("🎉 TODOS OS TESTES PASSARAM COM SUCESSO!")
         logger.info("📁 Verifique a pasta 'output' para o arquivo CSV gerado")
     else:
         logger.error("💥 ALGUNS TESTES FALHARAM!")
         logger.error("🔍 Verifique os logs acima para detalhes dos erros")
+        sys.exit(1)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+CNPJ Processor - Testes unitários dos filtros interativos
+Entrada do usuário simulada: não precisa de banco nem de terminal
+"""
+
+import sys
+import os
+import builtins
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.filters import CNPJFilters
+
+OPCOES_SITUACAO = {
+    '1': ('ativos', "Apenas empresas ATIVAS"),
+    '2': ('inaptos', "Apenas empresas INAPTAS"),
+}
+
+
+def responder(monkeypatch, *respostas):
+    """Substitui input() pelas respostas informadas, na ordem"""
+    fila = iter(respostas)
+    monkeypatch.setattr(builtins, 'input', lambda _prompt='': next(fila))
+
+
+def test_prompt_choice_returns_option_value(monkeypatch):
+    responder(monkeypatch, " 2 ")
+    assert CNPJFilters()._prompt_choice("Situação: ", OPCOES_SITUACAO, "Use 1 ou 2") == 'inaptos'
+
+
+def test_prompt_choice_is_case_insensitive(monkeypatch):
+    responder(monkeypatch, "S")
+    assert CNPJFilters()._prompt_choice("Com email: ", {'s': (True, "Com email")}, "Use s ou n") is True
+
+
+def test_prompt_choice_asks_again_on_invalid_input(monkeypatch, capsys):
+    responder(monkeypatch, "9", "x", "1")
+    assert CNPJFilters()._prompt_choice("Situação: ", OPCOES_SITUACAO, "Use 1 ou 2") == 'ativos'
+    assert capsys.readouterr().out.count("❌ Opção inválida. Use 1 ou 2") == 2
+
+
+def test_prompt_choice_empty_input(monkeypatch):
+    """Enter pula o filtro, a menos que a resposta vazia tenha um padrão em opcoes"""
+    responder(monkeypatch, "")
+    assert CNPJFilters()._prompt_choice("Situação: ", OPCOES_SITUACAO, "Use 1 ou 2") is None
+
+    responder(monkeypatch, "")
+    opcoes = dict(OPCOES_SITUACAO, **{'': ('ativos', "Apenas empresas ATIVAS")})
+    assert CNPJFilters()._prompt_choice("Situação: ", opcoes, "Use 1 ou 2") == 'ativos'
+
+
+def test_get_uf_retries_until_valid(monkeypatch):
+    """UF inválida é perguntada de novo em laço (sem recursão)"""
+    responder(monkeypatch, "BAH", "ba")
+    assert CNPJFilters().get_uf() == 'BA'
+
+
+def test_validar_data():
+    filtros = CNPJFilters()
+    for data in ("20240115", "20240229", "20230131", "20231231", "00010101"):
+        assert filtros._validar_data(data), data
+    for data in ("20230229", "20230431", "20231301", "20230100", "00000101",
+                 "2023011", "202301011", "2023-01-01", "abcdefgh", "20230132"):
+        assert not filtros._validar_data(data), data